@@ -0,0 +1,158 @@
+"""
+An in-process stand-in for pycronofy.Client, serving synthetic calendars so
+that PyAppointment can be benchmarked without network access.
+"""
+
+import datetime as dt
+import random
+import time
+import uuid
+
+import pytz
+
+def format_time(date):
+    return date.astimezone(pytz.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def parse_time(value):
+    """
+    Returns epoch seconds for the datetimes or ISO 8601 strings passed to the
+    client's read methods.
+    """
+    if isinstance(value, dt.datetime):
+        return int(value.timestamp())
+    return int(pytz.utc.localize(
+        dt.datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ')).timestamp())
+
+class Pages():
+    """
+    Mimics pycronofy's paged results.
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    def all(self):
+        return list(self.data)
+
+class FakeCalendar():
+    """
+    A synthetic calendar. Each day holds density timed events (a fraction
+    overlap of which are placed to overlap the previous event) between 07:00
+    and 19:00 in the timezone tz, and every all_day_every-th day carries an
+    all-day event.
+    """
+
+    def __init__(self, calendar_id, name, tz, start, days, density=4,
+                 overlap=0.2, all_day_every=7, seed=0):
+        self.calendar_id = calendar_id
+        self.name        = name
+        self.events      = []
+        self.tz          = tz
+
+        # Epoch second (start, end) of each event, for range queries, and the
+        # time each event was last modified, for change queries.
+        self.times    = []
+        self.modified = []
+
+        r = random.Random(seed)
+        for d in range(days):
+            day  = start + dt.timedelta(days=d)
+            prev = None
+            for n in range(density):
+                if prev is not None and r.random() < overlap:
+                    begin = prev + dt.timedelta(minutes=r.choice([0, 15, 30]))
+                else:
+                    begin = tz.localize(dt.datetime.combine(
+                        day, dt.time(r.randint(7, 18), r.choice([0, 15, 30, 45]))))
+                end = begin + dt.timedelta(minutes=r.choice([15, 30, 45, 60, 90, 120]))
+                self.add_event(format_time(begin), format_time(end), 'Event %d' % n)
+                prev = begin
+
+            if all_day_every and d % all_day_every == all_day_every - 1:
+                self.add_event(day.isoformat(), (day + dt.timedelta(days=1)).isoformat(),
+                               'All-day event')
+
+    def add_event(self, start, end, summary, event_id=None):
+        self.times.append((self.timestamp(start), self.timestamp(end)))
+        self.modified.append(time.time())
+        self.events.append({
+            'calendar_id': self.calendar_id,
+            'event_uid': event_id or 'evt_%s' % uuid.uuid4().hex,
+            'summary': summary,
+            'description': '',
+            'start': start,
+            'end': end,
+            'deleted': False,
+            'attendees': [],
+        })
+
+    def remove_event(self, event_id):
+        # Deleted events are kept, as Cronofy reports them as changes.
+        for n, e in enumerate(self.events):
+            if e['event_uid'] == event_id and not e['deleted']:
+                e['deleted']     = True
+                self.modified[n] = time.time()
+
+    def timestamp(self, value):
+        if 'T' in value:
+            return parse_time(value)
+
+        # All-day events start at midnight in the calendar's timezone.
+        return int(self.tz.localize(
+            dt.datetime.strptime(value, '%Y-%m-%d')).timestamp())
+
+class FakeClient():
+    """
+    Answers the subset of the pycronofy.Client API used by PyAppointment from
+    a list of FakeCalendar objects, counting the calls made.
+    """
+
+    def __init__(self, calendars):
+        self.calendars = { c.calendar_id: c for c in calendars }
+        self.calls     = 0
+
+    def list_calendars(self):
+        self.calls += 1
+        return [
+            { 'calendar_id': c.calendar_id, 'calendar_name': c.name }
+            for c in self.calendars.values()
+        ]
+
+    def _events(self, calendar_ids, from_date, to_date, last_modified=None,
+                include_deleted=False):
+        start, finish = parse_time(from_date), parse_time(to_date)
+        since = parse_time(last_modified) if last_modified is not None else None
+        for cal_id in calendar_ids:
+            calendar = self.calendars[cal_id]
+            for e, (e_start, e_end), modified in zip(
+                    calendar.events, calendar.times, calendar.modified):
+                if e['deleted'] and not include_deleted:
+                    continue
+                if since is not None and modified < since:
+                    continue
+                if e_start < finish and e_end > start:
+                    yield e
+
+    def read_events(self, calendar_ids=(), from_date=None, to_date=None,
+                    last_modified=None, include_deleted=False, **kwargs):
+        self.calls += 1
+        return Pages(self._events(calendar_ids, from_date, to_date,
+                                  last_modified, include_deleted))
+
+    def read_free_busy(self, calendar_ids=(), from_date=None, to_date=None, **kwargs):
+        self.calls += 1
+        return Pages(
+            { 'calendar_id': e['calendar_id'], 'start': e['start'], 'end': e['end'],
+              'free_busy_status': 'busy' }
+            for e in self._events(calendar_ids, from_date, to_date)
+        )
+
+    def upsert_event(self, calendar_id, event):
+        self.calls += 1
+        self.calendars[calendar_id].add_event(
+            format_time(event['start']), format_time(event['end']),
+            event['summary'], event['event_id'])
+
+    def delete_event(self, calendar_id, event_id):
+        self.calls += 1
+        self.calendars[calendar_id].remove_event(event_id)
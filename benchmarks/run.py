@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+"""
+Offline benchmarks for PyAppointment's worker startup, slot grid, booking
+validation and views, run against synthetic calendars served by an in-process
+stand-in for Cronofy.
+
+Usage:
+
+    python benchmarks/run.py [--repeat N] [--output results.json]
+                             [--compare baseline.json]
+
+Results are written as JSON, keyed by benchmark name, so that runs from
+different commits can be compared with --compare.
+"""
+
+import argparse
+import datetime as dt
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR  = os.path.dirname(BENCH_DIR)
+
+sys.path.insert(0, BASE_DIR)
+os.environ.setdefault("PYAPPOINTMENT_CONFIG", os.path.join(BENCH_DIR, "config.ini"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "pyappointment.settings")
+
+import django
+django.setup()
+
+from django.conf import settings as django_settings
+from django.test import Client
+
+from pyappointment import settings, calendar_link, views
+from fake_cronofy import FakeCalendar, FakeClient
+
+# Compressor caches compiled assets in production, so leave LESS compilation
+# out of the timings.
+django_settings.COMPRESS_ENABLED = False
+django_settings.COMPRESS_PRECOMPILERS = (('text/less', 'cat {infile} > {outfile}'),)
+
+# Number of synthetic events per calendar per day.
+DENSITIES = (2, 8, 24)
+
+def next_dst_change(tz, after):
+    """
+    Returns the first date after the given one on which the UTC offset of tz
+    changes.
+    """
+    day    = after
+    offset = tz.localize(dt.datetime.combine(day, dt.time(12))).utcoffset()
+    for i in range(366):
+        day += dt.timedelta(days=1)
+        if tz.localize(dt.datetime.combine(day, dt.time(12))).utcoffset() != offset:
+            return day
+    return after
+
+def make_client(density, start, days):
+    return FakeClient([
+        FakeCalendar('cal_work', 'Work', views.LOCALTZ, start, days,
+                     density=density, seed=1),
+        FakeCalendar('cal_personal', 'Personal', views.LOCALTZ, start, days,
+                     density=max(1, density // 2), seed=2),
+    ])
+
+def measure(repeat, fn, setup=None):
+    times = []
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return {
+        'runs': repeat,
+        'min_ms': round(min(times), 3),
+        'median_ms': round(statistics.median(times), 3),
+        'mean_ms': round(statistics.mean(times), 3),
+    }
+
+def cold():
+    """
+    Empties the calendar cache, so that each run fetches and indexes events.
+    """
+    calendar_link.busy_cache.clear()
+
+def worker_start():
+    """
+    Starts a fresh interpreter which loads the WSGI application and its URLs,
+    as uwsgi does each time it replaces a worker.
+    """
+    subprocess.check_call([
+        sys.executable, '-c',
+        'import pyappointment.wsgi; from django.urls import resolve; resolve("/")'
+    ], cwd=BASE_DIR)
+
+def run(repeat):
+    today  = dt.datetime.now(views.LOCALTZ).date()
+    monday = views.get_monday(today) + dt.timedelta(days=7)
+    weeks  = {
+        'normal': monday,
+        'dst': views.get_monday(next_dst_change(views.LOCALTZ, monday)),
+    }
+    span    = (max(weeks.values()) - monday).days + 14
+    results = {}
+    http    = Client()
+
+    results['startup/worker'] = measure(repeat, worker_start)
+
+    for density in DENSITIES:
+        calendar_link.use_client(make_client(density, monday - dt.timedelta(days=7), span + 7))
+
+        for week, week_monday in sorted(weeks.items()):
+            date = views.LOCALTZ.localize(dt.datetime.combine(week_monday, dt.time(9)))
+
+            for booking_type in sorted(settings.BOOKING_TYPES):
+                name = '%s/density=%d/week=%s' % (booking_type, density, week)
+
+                results['grid/' + name] = measure(
+                    repeat, lambda: views.generate_week_times(booking_type, date), cold)
+
+                # Validate every cell of the grid against the calendar.
+                grid  = views.generate_week_times(booking_type, date)
+                cells = [ c for row in grid.rows if row != 'gap' for c in row ]
+                busy  = calendar_link.get_busy(date, 7)
+                duration = dt.timedelta(minutes=settings.BOOKING_TYPES[booking_type]['duration'])
+
+                results['validate/' + name] = measure(repeat, lambda: [
+                    views.check_available(booking_type, c.date, c.date + duration, busy)
+                    for c in cells
+                ])
+
+                results['view_week/' + name] = measure(repeat, lambda: http.get(
+                    '/%s/%s' % (booking_type, date.strftime('%Y-%m-%d'))), cold)
+
+                free = [ c.date for c in cells if c.available ]
+                if free:
+                    url = '/book/%s/%s' % (booking_type, free[0].strftime('%Y-%m-%d/%H-%M'))
+                    results['booking_form/' + name] = measure(
+                        repeat, lambda: http.get(url), cold)
+
+    return results
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=BASE_DIR,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline):
+    print('%-55s %12s %12s %8s' % ('benchmark', 'baseline ms', 'current ms', 'ratio'))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        old, new = baseline[name]['median_ms'], results[name]['median_ms']
+        print('%-55s %12.3f %12.3f %8.2f' % (name, old, new, new / old if old else 0))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of runs of each benchmark')
+    parser.add_argument('--output', help='file to write results to, as JSON')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='results file from an earlier run to compare against')
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    report  = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'created': dt.datetime.utcnow().isoformat() + 'Z',
+        'repeat': args.repeat,
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)['results'])
+
+if __name__ == '__main__':
+    main()
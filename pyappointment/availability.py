@@ -1,37 +1,69 @@
 import datetime as dt
-import pytz
+import math
 
 from django.core.exceptions import ImproperlyConfigured
 import pyappointment.settings as settings
+from pyappointment.localtime import to_epoch
+
+DAYS = ('MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT', 'SUN')
+
+def minute_of_day(time):
+    """
+    Returns the number of minutes since midnight for a datetime.time object.
+    """
+    return time.hour * 60 + time.minute
+
+def parse_time(timestr):
+    """
+    Parses a time of day given as HH:MM. This is done by hand, as strptime is
+    slow to load and the format is fixed.
+    """
+    hour, minute = timestr.strip().split(':')
+    return dt.time(int(hour), int(minute))
 
 class Availability():
     """
-    A class detailing availability times.
+    A class detailing availability times. Time ranges are stored as pairs of
+    minute-of-day integers.
     """
 
     time_ranges = []
 
     def __init__(self, times):
-        self.time_ranges = [ [ dt.datetime.combine(dt.date.today(), t) for t in tt ] for tt in times ] 
+        self.time_ranges = [ tuple(minute_of_day(t) for t in tt) for tt in times ]
 
     def is_available(self, start_time, finish_time):
-        # Convert to datetime so that we can use timedelta
-        start = dt.datetime.combine(dt.date.today(), start_time)
-        finish = dt.datetime.combine(dt.date.today(), finish_time)
+        return self.covers(minute_of_day(start_time), minute_of_day(finish_time))
 
+    def covers(self, start, finish):
+        """
+        Returns whether one of the time ranges covers the minutes of the day
+        from start to finish.
+        """
         for rs, rf in self.time_ranges:
             if rs <= start and finish <= rf:
                 return True
         return False
 
+    def intervals(self, date, tz):
+        """
+        Returns the availability ranges on a given date as a list of (start,
+        end) epoch seconds, localised to the timezone tz.
+        """
+        return sorted([
+            (to_epoch(tz, date, rs * 60), to_epoch(tz, date, rf * 60))
+            for rs, rf in self.time_ranges
+        ])
+
     def day_range(self):
         """
         Returns extremes of the availability ranges
         """
         if self.time_ranges == []:
             return None, None
-        return min(self.time_ranges, key=lambda t: t[0])[0].time(), \
-               max(self.time_ranges, key=lambda t: t[1])[1].time()
+        t_min = min(t[0] for t in self.time_ranges)
+        t_max = max(t[1] for t in self.time_ranges)
+        return dt.time(t_min // 60, t_min % 60), dt.time(t_max // 60, t_max % 60)
 
     @classmethod
     def from_config(cls, config_str):
@@ -41,15 +73,164 @@ class Availability():
 
         try:
             return cls([
-                tuple(
-                    dt.datetime.strptime(timestr.strip(), '%H:%M').time()
-                    for timestr in a.split('-')
-                )
+                tuple(parse_time(timestr) for timestr in a.split('-'))
                 for a in config_str.split(',')
             ])
         except ValueError:
             raise ImproperlyConfigured("Unable to parse availability strings.")
 
+NO_AVAIL = Availability([])
+
+##
+## Interval-set operations. Interval lists are sorted lists of (start, end)
+## pairs of epoch seconds, which are half-open so that end is not included.
+##
+
+def interval_intersection(a, b):
+    """
+    Returns the intersection of two interval lists. Each list should consist
+    of disjoint intervals.
+    """
+    result = []
+    i, j = 0, 0
+    while i < len(a) and j < len(b):
+        start = max(a[i][0], b[j][0])
+        end   = min(a[i][1], b[j][1])
+        if start < end:
+            result.append((start, end))
+
+        # Move past whichever interval finishes first.
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+def interval_subtract(a, b):
+    """
+    Returns the intervals in a which are not covered by any interval in b. The
+    list b should consist of disjoint intervals.
+    """
+    result = []
+    j = 0
+    for start, end in a:
+        # Skip intervals in b that finish before this one starts.
+        while j < len(b) and b[j][1] <= start:
+            j += 1
+
+        k = j
+        while k < len(b) and b[k][0] < end:
+            if b[k][0] > start:
+                result.append((start, b[k][0]))
+            start = max(start, b[k][1])
+            k += 1
+
+        if start < end:
+            result.append((start, end))
+    return result
+
 MEETING_AVAIL = [
     Availability.from_config(s) for s in settings.AVAIL_CONFIG_STRINGS
 ]
+
+class BookingRules():
+    """
+    The availability rules of a single booking type, compiled from its
+    configuration: one Availability per weekday, plus a table of overrides for
+    specific dates. If any specific dates are given, they replace the weekly
+    availability entirely.
+    """
+
+    def __init__(self, weekly, dates):
+        self.weekly = weekly
+        self.dates  = dates
+
+    def for_date(self, date):
+        """
+        Returns the Availability that applies on a given date.
+        """
+        if self.dates:
+            return self.dates.get(date, NO_AVAIL)
+        return self.weekly[date.weekday()]
+
+    def display_range(self, date):
+        """
+        Returns the range of times to display on the week view for a given
+        date, or (None, None) if the day should not be displayed.
+        """
+        t_min, t_max = MEETING_AVAIL[date.weekday()].day_range()
+        if t_min is not None and date in self.dates:
+            t_min, t_max = self.dates[date].day_range()
+        return t_min, t_max
+
+    @classmethod
+    def from_config(cls, booking_info):
+        if 'availability' not in booking_info:
+            return cls(MEETING_AVAIL, {})
+
+        weekly = [ NO_AVAIL ] * len(DAYS)
+        dates  = {}
+
+        for key, val in booking_info['availability'].items():
+            # Specific dates are defined in the form 'YYYY-MM-DD'.
+            if '-' in key:
+                try:
+                    d_y, d_m, d_d = [ int(a) for a in key.split('-') ]
+                    dates[dt.date(d_y, d_m, d_d)] = Availability.from_config(val)
+                except ValueError:
+                    raise ImproperlyConfigured("Unable to parse availability date '%s'." % key)
+            elif key.upper() in DAYS:
+                weekly[DAYS.index(key.upper())] = Availability.from_config(val)
+
+        return cls(weekly, dates)
+
+def booking_bounds(booking_info, now):
+    """
+    Returns the (lower, upper) epoch seconds between which a booking must lie,
+    given the current time now in epoch seconds, from the lead_time and
+    future_limit settings. The upper bound is None if there is no future
+    limit.
+    """
+    lower = math.ceil(now + booking_info['lead_time'] * 3600)
+    upper = None
+    if booking_info['future_limit'] != 0:
+        # Bookings may start at the future limit, so they may finish after it.
+        upper = int(now + booking_info['future_limit'] * 86400) + \
+                booking_info['duration'] * 60
+    return lower, upper
+
+def free_intervals(rules, date, tz, lower, upper, busy):
+    """
+    Returns the sorted list of free intervals on a given date: the
+    availability windows from rules, clipped to the [lower, upper) booking
+    bounds, with the intervals of the BusyIndex busy removed.
+    """
+    windows = rules.for_date(date).intervals(date, tz)
+    if not windows:
+        return []
+
+    if upper is None:
+        upper = max(w[1] for w in windows)
+
+    free = interval_intersection(windows, [ (lower, upper) ])
+    if not free:
+        return []
+
+    return interval_subtract(free, busy.between(free[0][0], free[-1][1]))
+
+def slot_starts(free, anchor, step, duration):
+    """
+    Generates the start times of slots which fit entirely inside the free
+    intervals, where slots start every step seconds from anchor and last for
+    duration seconds.
+    """
+    for start, end in free:
+        # First slot boundary on or after the start of this interval.
+        slot = anchor + max(0, -(-(start - anchor) // step)) * step
+        while slot + duration <= end:
+            yield slot
+            slot += step
+
+BOOKING_RULES = {
+    name: BookingRules.from_config(info) for name, info in settings.BOOKING_TYPES.items()
+}
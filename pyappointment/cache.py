@@ -0,0 +1,246 @@
+import contextlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+
+from collections import OrderedDict
+
+from pyappointment.settings import CACHE_SHARED_FILE
+
+class TTLCache():
+    """
+    A thread-safe, size-bounded cache whose entries expire after ttl seconds.
+    Expired entries may still be served as stale data for a further stale
+    seconds. When the cache is full, the least recently used entry is evicted.
+    """
+
+    def __init__(self, ttl, maxsize, stale=0):
+        self.ttl     = ttl
+        self.maxsize = maxsize
+        self.stale   = stale
+        self.entries = OrderedDict()
+        self.lock    = threading.Lock()
+
+    def lookup(self, key):
+        """
+        Returns a tuple (value, fresh) for the entry stored under key, where
+        fresh is False if the entry has expired but is still within the
+        staleness window. Returns (None, False) if there is no usable entry.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None, False
+
+            stored, value = entry
+            age = time.monotonic() - stored
+            if age > self.ttl + self.stale:
+                del self.entries[key]
+                return None, False
+
+            self.entries.move_to_end(key)
+            return value, age <= self.ttl
+
+    def get(self, key):
+        """
+        Returns the value stored under key, or None if it is missing or has
+        expired.
+        """
+        value, fresh = self.lookup(key)
+        return value if fresh else None
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def keys(self):
+        with self.lock:
+            return list(self.entries)
+
+    def invalidate(self, predicate):
+        """
+        Removes every entry whose key satisfies predicate.
+        """
+        with self.lock:
+            for key in [ k for k in self.entries if predicate(k) ]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    @contextlib.contextmanager
+    def lock_key(self, key):
+        """
+        Serialises work on key across processes sharing the cache. Entries
+        are private to this process, so there is nothing to do.
+        """
+        yield
+
+class SharedCache():
+    """
+    A cache with the same interface as TTLCache, stored in an SQLite database
+    in WAL mode so that every worker process can read and update it, and
+    entries outlive the processes that stored them. Caches with different
+    names can share the database file. When the cache is full, the least
+    recently stored entries are evicted.
+    """
+
+    def __init__(self, path, name, ttl, maxsize, stale=0):
+        self.path    = path
+        self.name    = name
+        self.ttl     = ttl
+        self.maxsize = maxsize
+        self.stale   = stale
+        self.local   = threading.local()
+
+    def connect(self):
+        # Connections can't be shared between threads, nor survive a fork.
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache (name TEXT, key TEXT, '
+                'key_data BLOB, stored REAL, value BLOB, PRIMARY KEY (name, key))')
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    def lookup(self, key):
+        """
+        Returns a tuple (value, fresh) for the entry stored under key, where
+        fresh is False if the entry has expired but is still within the
+        staleness window. Returns (None, False) if there is no usable entry.
+        """
+        row = self.connect().execute(
+            'SELECT stored, value FROM cache WHERE name = ? AND key = ?',
+            (self.name, repr(key))).fetchone()
+        if row is None:
+            return None, False
+
+        age = time.time() - row[0]
+        if age > self.ttl + self.stale:
+            return None, False
+        return pickle.loads(zlib.decompress(row[1])), age <= self.ttl
+
+    def get(self, key):
+        value, fresh = self.lookup(key)
+        return value if fresh else None
+
+    def set(self, key, value):
+        data = zlib.compress(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        conn = self.connect()
+        with self.transaction(conn):
+            conn.execute(
+                'INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)',
+                (self.name, repr(key), pickle.dumps(key), time.time(), data))
+            conn.execute(
+                'DELETE FROM cache WHERE name = ? AND key NOT IN ('
+                'SELECT key FROM cache WHERE name = ? ORDER BY stored DESC LIMIT ?)',
+                (self.name, self.name, self.maxsize))
+
+    def keys(self):
+        return [
+            pickle.loads(k) for k, in self.connect().execute(
+                'SELECT key_data FROM cache WHERE name = ?', (self.name,))
+        ]
+
+    def invalidate(self, predicate):
+        """
+        Removes every entry whose key satisfies predicate.
+        """
+        conn = self.connect()
+        with self.transaction(conn):
+            rows = conn.execute(
+                'SELECT key, key_data FROM cache WHERE name = ?', (self.name,)).fetchall()
+            conn.executemany(
+                'DELETE FROM cache WHERE name = ? AND key = ?',
+                [ (self.name, k) for k, data in rows if predicate(pickle.loads(data)) ])
+
+    def clear(self):
+        self.connect().execute('DELETE FROM cache WHERE name = ?', (self.name,))
+
+    @contextlib.contextmanager
+    def transaction(self, conn):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    @contextlib.contextmanager
+    def lock_key(self, key):
+        """
+        Serialises work on key across processes sharing the cache, using a
+        byte-range lock on a file next to the database. Keys may share a
+        lock, but that only costs some waiting.
+        """
+        import fcntl
+
+        with open(self.path + '.lock', 'a') as f:
+            offset = zlib.crc32(repr((self.name, key)).encode('utf-8')) % 4096
+            fcntl.lockf(f, fcntl.LOCK_EX, 1, offset)
+            try:
+                yield
+            finally:
+                fcntl.lockf(f, fcntl.LOCK_UN, 1, offset)
+
+def make_cache(name, ttl, maxsize, stale=0):
+    """
+    Returns a cache shared between worker processes if CACHE_SHARED_FILE is
+    set, or a TTLCache private to this process otherwise.
+    """
+    if CACHE_SHARED_FILE:
+        return SharedCache(CACHE_SHARED_FILE, name, ttl, maxsize, stale)
+    return TTLCache(ttl, maxsize, stale)
+
+class SingleFlight():
+    """
+    Coalesces concurrent calls that share a key: the first caller runs the
+    call, and any others arriving while it is in flight wait for it and share
+    its result (or exception).
+    """
+
+    class Call():
+        def __init__(self):
+            self.done   = threading.Event()
+            self.result = None
+            self.error  = None
+
+    def __init__(self):
+        self.calls = {}
+        self.lock  = threading.Lock()
+
+    def do(self, key, fn):
+        with self.lock:
+            call   = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = SingleFlight.Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+        return call.result
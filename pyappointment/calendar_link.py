@@ -1,9 +1,93 @@
-import pycronofy
 import pytz
 import os
+import bisect
+import hashlib
+import logging
+import threading
+import concurrent.futures
+import time
 import datetime as dt
 
-from pyappointment.settings import CRONOFY_ACCESS_TOKEN, CAL_NAMES, CAL_CREATE_BOOKING
+from pyappointment.settings import CRONOFY_ACCESS_TOKEN, \
+    CRONOFY_FAILURE_THRESHOLD, CRONOFY_RETRY_AFTER, CRONOFY_CONCURRENCY, CAL_NAMES, \
+    CAL_CREATE_BOOKING, SHOW_REASONS, SHOW_CONFLICTING_EVENTS, CALENDAR_CACHE_TTL, \
+    CALENDAR_CACHE_SIZE, CALENDAR_STALE_TTL, CALENDAR_LIST_TTL, CALENDAR_PREFETCH_WORKERS, \
+    CALENDAR_PREFETCH_LIMIT, MIRROR_ENABLED, TIME_ZONE
+from pyappointment import localtime
+from pyappointment.cache import SingleFlight, make_cache
+from pyappointment.timing import timed
+
+logger = logging.getLogger(__name__)
+
+class CalendarUnavailable(Exception):
+    """
+    Raised when busy data can't be fetched from Cronofy, and there is no
+    cached data to fall back on.
+    """
+    pass
+
+class CircuitBreaker():
+    """
+    Stops calls to a failing backend. After threshold consecutive failures the
+    breaker opens, and calls are refused for cooldown seconds. After that, one
+    trial call is let through each cooldown period until a call succeeds and
+    the breaker closes again.
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown  = cooldown
+        self.failures  = 0
+        self.opened_at = 0
+        self.lock      = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.failures < self.threshold:
+                return True
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                # Let this call through as a trial, and hold off any others.
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+# Busy intervals keyed by (calendar ids, UTC start, UTC finish, summaries).
+busy_cache = make_cache('busy', CALENDAR_CACHE_TTL, CALENDAR_CACHE_SIZE, CALENDAR_STALE_TTL)
+
+# Fetches of busy intervals in flight, with the same keys as busy_cache.
+busy_fetches = SingleFlight()
+
+# Keys of cache entries being refreshed in the background.
+_refreshing      = set()
+_refreshing_lock = threading.Lock()
+
+# Keys of busy_cache entries being prefetched, at most CALENDAR_PREFETCH_LIMIT
+# at a time, by a pool of CALENDAR_PREFETCH_WORKERS threads.
+_prefetching      = set()
+_prefetching_lock = threading.Lock()
+_prefetch_pool    = concurrent.futures.ThreadPoolExecutor(CALENDAR_PREFETCH_WORKERS)
+
+# Threads for sending several requests to Cronofy at once.
+_request_pool = concurrent.futures.ThreadPoolExecutor(CRONOFY_CONCURRENCY)
+
+breaker = CircuitBreaker(CRONOFY_FAILURE_THRESHOLD, CRONOFY_RETRY_AFTER)
+
+# Calendar ids resolved from the configured calendar names.
+calendar_cache = make_cache('calendars', CALENDAR_LIST_TTL, 1, 86400)
+
+# The Cronofy client shared by all requests in this worker.
+_client      = None
+_client_lock = threading.Lock()
 
 def utc_range(today, delta):
     # Get current day for timezone.
@@ -19,8 +103,125 @@ def utc_range(today, delta):
     
     return midnight.astimezone(pytz.utc), midnight_p.astimezone(pytz.utc), 
 
+def to_timestamp(date):
+    """
+    Converts a timezone-aware datetime to integer seconds since the epoch.
+    """
+    return int(date.timestamp())
+
+def parse_event_time(iso_str, tz):
+    """
+    Converts a Cronofy ISO 8601 time to integer seconds since the epoch. Times
+    without timezone information belong to all-day events, and are assumed to
+    be in the timezone tz.
+    """
+    return localtime.parse_iso(iso_str, tz)
+
+class BusyIndex():
+    """
+    A sorted index of busy intervals, built once from a list of calendar
+    events. Overlapping events are merged into disjoint intervals stored as
+    start/end epoch seconds, so that overlap queries are answered by binary
+    search.
+    """
+
+    def __init__(self, intervals):
+        # Events in the order given, kept so that conflicts can be named, and
+        # their indexes sorted by start time. Zero-length events are kept, as
+        # they still conflict with any slot they fall strictly inside.
+        self.events   = [ i for i in intervals if i[0] <= i[1] ]
+        self.by_start = sorted(range(len(self.events)), key=lambda n: self.events[n][0])
+
+        # Merged intervals, and the position in by_start of the first event
+        # in each.
+        self.starts = []
+        self.ends   = []
+        self.first  = []
+
+        self._fingerprint = None
+
+        for k, n in enumerate(self.by_start):
+            start, end, summary = self.events[n]
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+                self.first.append(k)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def fingerprint(self):
+        """
+        Returns a digest of the events in the index, which changes whenever
+        the calendar does.
+        """
+        if self._fingerprint is None:
+            self._fingerprint = hashlib.sha1(
+                repr(sorted(self.events)).encode('utf-8')).hexdigest()
+        return self._fingerprint
+
+    def between(self, start, finish):
+        """
+        Returns the sorted list of busy (start, end) intervals overlapping
+        [start, finish), given as epoch seconds.
+        """
+        i = bisect.bisect_right(self.ends, start)
+        j = bisect.bisect_left(self.starts, finish)
+        return list(zip(self.starts[i:j], self.ends[i:j]))
+
+    def conflict(self, start, finish):
+        """
+        Returns the summary of an event overlapping [start, finish), given as
+        epoch seconds, or None if the range is free. Where several events
+        overlap, the first in the order read from the calendar is named.
+        """
+        i = bisect.bisect_right(self.ends, start)
+        j = bisect.bisect_left(self.starts, finish)
+        if i >= j:
+            return None
+
+        # Find the events inside these merged intervals that actually overlap.
+        last  = self.first[j] if j < len(self.first) else len(self.by_start)
+        found = [ n for n in self.by_start[self.first[i]:last]
+                  if start < self.events[n][1] and finish > self.events[n][0] ]
+        return self.events[min(found)][2] if found else None
+
+    @classmethod
+    def from_events(cls, events, tz):
+        return cls([
+            (parse_event_time(e['start'], tz), parse_event_time(e['end'], tz),
+             e.get('summary', ''))
+            for e in events
+        ])
+
 def connect_calendar():
-    return pycronofy.Client(access_token=CRONOFY_ACCESS_TOKEN)
+    """
+    Returns the Cronofy client for this worker, creating it on first use.
+    pycronofy and requests take a while to import, so they are only loaded
+    here, when Cronofy is first contacted.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            import pycronofy
+            from pyappointment.cronofy_session import SessionRequestHandler
+
+            _client = pycronofy.Client(access_token=CRONOFY_ACCESS_TOKEN)
+            _client.request_handler = SessionRequestHandler(_client.auth)
+        return _client
+
+def use_client(client):
+    """
+    Replaces the Cronofy client for this worker, e.g. with a stand-in for
+    benchmarking, and forgets everything cached from the previous one.
+    """
+    global _client
+    with _client_lock:
+        _client = client
+    busy_cache.clear()
+    calendar_cache.clear()
 
 def filter_ids(cal_ids):
     # Figure out which calendar IDs we need to check.
@@ -29,14 +230,360 @@ def filter_ids(cal_ids):
         c['calendar_name'].lower() in map(str.lower, CAL_NAMES)
     ]
 
+def calendar_ids(handle=None):
+    """
+    Returns a tuple (check_ids, book_id) holding the ids of the calendars named
+    in CAL_NAMES, and of the calendar named by CAL_CREATE_BOOKING (or None if
+    it can't be found). The ids are cached, and refreshed from Cronofy every
+    CALENDAR_LIST_TTL seconds. The refresh runs in the background, so the old
+    ids are used until it completes, and kept if it fails.
+    """
+    ids, fresh = calendar_cache.lookup('ids')
+    if fresh:
+        return ids
+
+    if ids is not None:
+        refresh('calendar-ids', lambda: load_calendar_ids(handle))
+        return ids
+
+    return load_calendar_ids(handle)
+
+def load_calendar_ids(handle=None):
+    """
+    Lists the calendars from Cronofy and caches the ids returned by
+    calendar_ids.
+    """
+    if handle is None:
+        handle = connect_calendar()
+
+    try:
+        with timed('calendars'):
+            cals = handle.list_calendars()
+    except Exception as e:
+        raise CalendarUnavailable("Unable to list calendars: %s" % e) from e
+
+    book_ids = [
+        c['calendar_id'] for c in cals if
+        c['calendar_name'].lower() == CAL_CREATE_BOOKING.lower()
+    ]
+    ids = (filter_ids(cals), book_ids[0] if book_ids else None)
+    calendar_cache.set('ids', ids)
+    return ids
+
+def read_calendars(read, cal_ids, **kwargs):
+    """
+    Calls the pycronofy read method read for each of the calendars cal_ids
+    at once, on a pool of CRONOFY_CONCURRENCY threads, and returns the
+    combined results.
+    """
+    if len(cal_ids) <= 1:
+        return read(calendar_ids=cal_ids, **kwargs).all()
+
+    futures = [
+        _request_pool.submit(lambda cal_id: read(calendar_ids=[ cal_id ], **kwargs).all(), cal_id)
+        for cal_id in cal_ids
+    ]
+    return [ item for f in futures for item in f.result() ]
+
 def get_events(date, delta, handle=None, cal_ids=None):
     # Create Cronofy client object.
     if handle is None:
         handle = connect_calendar()
     if cal_ids is None:
-        cal_ids = filter_ids(handle.list_calendars())
+        cal_ids = calendar_ids(handle)[0]
 
     # Look up items in delta's events
     start, finish = utc_range(date, dt.timedelta(delta))
-    return handle.read_events(
-        calendar_ids=cal_ids, from_date=start, to_date=finish).all()
+    with timed('cronofy'):
+        return read_calendars(
+            handle.read_events, cal_ids, from_date=start, to_date=finish)
+
+def get_free_busy(date, delta, handle=None, cal_ids=None):
+    """
+    Returns the busy blocks in the delta days starting from date, using
+    Cronofy's free/busy endpoint. Blocks only carry start and end times, so
+    are much cheaper to fetch than full events.
+    """
+    if handle is None:
+        handle = connect_calendar()
+    if cal_ids is None:
+        cal_ids = calendar_ids(handle)[0]
+
+    start, finish = utc_range(date, dt.timedelta(delta))
+    with timed('cronofy'):
+        blocks = read_calendars(
+            handle.read_free_busy, cal_ids, from_date=start, to_date=finish)
+    return [ b for b in blocks if b.get('free_busy_status') != 'free' ]
+
+def busy_key(date, delta, cal_ids, summaries):
+    """
+    Returns the busy_cache key for the delta days starting from date.
+    """
+    start, finish = utc_range(date, dt.timedelta(delta))
+    return (tuple(sorted(cal_ids)), to_timestamp(start), to_timestamp(finish),
+            summaries)
+
+def get_busy(date, delta, handle=None, cal_ids=None, fresh=False, summaries=None):
+    """
+    Returns a BusyIndex of the events in the delta days starting from date.
+
+    Results are cached, and concurrent requests for the same range share a
+    single fetch, even across worker processes if the cache is shared. Once
+    cached data expires, it is still served for up to CALENDAR_STALE_TTL
+    seconds while it is refreshed in the background. If fresh is True, the
+    calendar is always queried directly.
+
+    Only free/busy blocks are fetched unless summaries is True, in which case
+    full events are read so that conflicting events can be named. By default,
+    this happens when SHOW_REASONS and SHOW_CONFLICTING_EVENTS are both set.
+
+    If MIRROR_ENABLED is set and the local mirror covers the range, events
+    are read from the mirror instead of Cronofy, unless fresh is True.
+
+    Raises CalendarUnavailable if Cronofy can't be reached and there is no
+    usable cached data.
+    """
+    if handle is None:
+        handle = connect_calendar()
+    if cal_ids is None:
+        cal_ids = calendar_ids(handle)[0]
+    if summaries is None:
+        summaries = SHOW_REASONS and SHOW_CONFLICTING_EVENTS
+
+    key = busy_key(date, delta, cal_ids, summaries)
+
+    def fetch():
+        if MIRROR_ENABLED and not fresh:
+            # Imported here, as the mirror needs Django's models to be loaded.
+            from pyappointment import mirror
+            if mirror.covers(cal_ids, key[1], key[2]):
+                busy = mirror.busy(cal_ids, key[1], key[2])
+                busy_cache.set(key, busy)
+                return busy
+
+        if not breaker.allow():
+            raise CalendarUnavailable("Calendar service is not responding.")
+
+        read = get_events if summaries else get_free_busy
+        try:
+            busy = BusyIndex.from_events(
+                read(date, delta, handle=handle, cal_ids=cal_ids), date.tzinfo)
+        except Exception as e:
+            breaker.failure()
+            raise CalendarUnavailable("Unable to fetch calendar: %s" % e) from e
+
+        breaker.success()
+        busy_cache.set(key, busy)
+        return busy
+
+    def fetch_once():
+        # With a shared cache, another worker may have fetched the range
+        # while this one waited for the lock.
+        with busy_cache.lock_key(key):
+            busy = busy_cache.get(key)
+            return busy if busy is not None else fetch()
+
+    if fresh:
+        return fetch()
+
+    busy, is_fresh = busy_cache.lookup(key)
+    if busy is None:
+        return busy_fetches.do(key, fetch_once)
+
+    if not is_fresh:
+        refresh(key, fetch_once)
+    return busy
+
+def refresh(key, fetch):
+    """
+    Runs fetch in a background thread to refresh the cache entry under key,
+    unless a refresh of it is already under way.
+    """
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+
+    def run():
+        try:
+            busy_fetches.do(key, fetch)
+        except CalendarUnavailable:
+            pass
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(key)
+            _close_db()
+
+    threading.Thread(target=run, name='calendar-refresh', daemon=True).start()
+
+def warm(date, weeks, handle=None):
+    """
+    Reads the busy intervals for weeks weeks starting from date in a single
+    call to Cronofy, and caches them a week at a time, as get_busy would with
+    its defaults for each week. Returns the number of events read.
+    """
+    if handle is None:
+        handle = connect_calendar()
+    cal_ids   = calendar_ids(handle)[0]
+    summaries = SHOW_REASONS and SHOW_CONFLICTING_EVENTS
+
+    if not breaker.allow():
+        raise CalendarUnavailable("Calendar service is not responding.")
+
+    read = get_events if summaries else get_free_busy
+    try:
+        events = read(date, 7 * weeks, handle=handle, cal_ids=cal_ids)
+    except Exception as e:
+        breaker.failure()
+        raise CalendarUnavailable("Unable to fetch calendar: %s" % e) from e
+    breaker.success()
+
+    busy = BusyIndex.from_events(events, date.tzinfo)
+    for week in range(weeks):
+        key = busy_key(date + dt.timedelta(days=7 * week), 7, cal_ids, summaries)
+        busy_cache.set(key, BusyIndex(
+            [ e for e in busy.events if e[0] < key[2] and e[1] > key[1] ]))
+
+    return len(events)
+
+def prefetch(dates, delta):
+    """
+    Fetches busy intervals for the delta days starting from each of dates
+    into the cache in the background, as get_busy would with its defaults.
+    Ranges already cached or being prefetched are skipped, as are any beyond
+    CALENDAR_PREFETCH_LIMIT prefetches in flight.
+    """
+    try:
+        cal_ids = calendar_ids()[0]
+    except CalendarUnavailable:
+        return
+
+    summaries = SHOW_REASONS and SHOW_CONFLICTING_EVENTS
+    for date in dates:
+        key = busy_key(date, delta, cal_ids, summaries)
+        if busy_cache.get(key) is not None:
+            continue
+
+        with _prefetching_lock:
+            if key in _prefetching or len(_prefetching) >= CALENDAR_PREFETCH_LIMIT:
+                continue
+            _prefetching.add(key)
+
+        _prefetch_pool.submit(_prefetch, key, date, delta)
+
+def _prefetch(key, date, delta):
+    try:
+        get_busy(date, delta)
+    except CalendarUnavailable:
+        pass
+    finally:
+        with _prefetching_lock:
+            _prefetching.discard(key)
+        _close_db()
+
+def _close_db():
+    # Threads reading the mirror each open their own database connection.
+    if MIRROR_ENABLED:
+        from django.db import connection
+        connection.close()
+
+def invalidate(start, finish):
+    """
+    Drops cached busy intervals for any range overlapping [start, finish),
+    given as timezone-aware datetimes.
+    """
+    start, finish = to_timestamp(start), to_timestamp(finish)
+    busy_cache.invalidate(lambda key: key[1] < finish and key[2] > start)
+
+def upsert_events(calendar_id, events, handle=None):
+    """
+    Creates events in calendar_id, sending the requests at once on a pool of
+    CRONOFY_CONCURRENCY threads. The events themselves are left unchanged,
+    with their times as datetimes.
+
+    Either all of the events are created, or none: if any fails, those which
+    were created are deleted again and CalendarUnavailable is raised.
+    """
+    if handle is None:
+        handle = connect_calendar()
+
+    def upsert(event):
+        # pycronofy replaces the times in the event it is given with strings.
+        try:
+            handle.upsert_event(calendar_id=calendar_id, event=dict(event))
+        except Exception as e:
+            return e
+
+    with timed('upsert'):
+        if len(events) <= 1:
+            errors = [ upsert(event) for event in events ]
+        else:
+            errors = list(_request_pool.map(upsert, events))
+
+    failed = [ e for e in errors if e is not None ]
+    if not failed:
+        return
+
+    for event, error in zip(events, errors):
+        if error is None:
+            try:
+                handle.delete_event(calendar_id, event['event_id'])
+            except Exception as e:
+                logger.warning("Unable to delete event %s: %s", event['event_id'], e)
+    raise CalendarUnavailable("Unable to create events: %s" % failed[0]) from failed[0]
+
+def record_booking(calendar_id, event):
+    """
+    Records an event just created in calendar_id, so that its time can't be
+    offered again before the calendar is next read. Unless the cache is
+    shared, this only reaches the cache of this worker process.
+    """
+    invalidate(event['start'], event['end'])
+
+    if MIRROR_ENABLED and calendar_id in calendar_ids()[0]:
+        from pyappointment import mirror
+        mirror.add_event(calendar_id, event['event_id'],
+                         to_timestamp(event['start']), to_timestamp(event['end']),
+                         event['summary'])
+
+def apply_changes(changes_since, handle=None):
+    """
+    Handles a change notification from Cronofy by reading the events changed
+    since changes_since, and dropping the cached busy intervals of any range
+    that they (or, if mirrored, their previous times) overlap. Only the
+    cached ranges and the mirror window are read. Returns the number of
+    changed events.
+    """
+    ranges = [ (key[1], key[2]) for key in busy_cache.keys() ]
+    if MIRROR_ENABLED:
+        from pyappointment import mirror
+        state = mirror.current_state()
+        if state is not None:
+            ranges.append((state.window_start, state.window_end))
+    if not ranges:
+        return 0
+
+    if handle is None:
+        handle = connect_calendar()
+    cal_ids = calendar_ids(handle)[0]
+
+    start  = dt.datetime.fromtimestamp(min(r[0] for r in ranges), pytz.utc)
+    finish = dt.datetime.fromtimestamp(max(r[1] for r in ranges), pytz.utc)
+    try:
+        with timed('cronofy'):
+            events = handle.read_events(
+                calendar_ids=cal_ids, from_date=start, to_date=finish,
+                last_modified=changes_since, include_deleted=True,
+                include_moved=True).all()
+    except Exception as e:
+        raise CalendarUnavailable("Unable to read changes: %s" % e) from e
+
+    tz = pytz.timezone(TIME_ZONE)
+    changed = [ (parse_event_time(e['start'], tz), parse_event_time(e['end'], tz))
+                for e in events ]
+    if MIRROR_ENABLED:
+        changed.extend(mirror.apply_events(events))
+
+    busy_cache.invalidate(
+        lambda key: any(s < key[2] and e > key[1] for s, e in changed))
+    return len(events)
@@ -0,0 +1,139 @@
+import json
+import os
+import re
+
+from django.core.exceptions import ImproperlyConfigured
+
+# Options which must be given in config.ini, by block.
+REQUIRED = (
+    ('django', ('SECRET_KEY', 'ALLOWED_HOSTS', 'DEBUG', 'ADMINS')),
+    ('meetings', ('ORGANIZER_NAME', 'ORGANIZER_EMAIL', 'ORGANIZER_GREETING',
+                  'BOOKING_TYPES')),
+    ('email', ('USE_SSL', 'ADDRESS', 'HOST', 'PORT', 'HOST_USER', 'HOST_PASSWORD')),
+    ('cronofy', ('ACCESS_TOKEN',)),
+    ('calendar', ('CHECK', 'BOOK', 'TIME_ZONE', 'SHOW_REASONS',
+                  'SHOW_CONFLICTING_EVENTS')),
+    ('availability', ('MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT', 'SUN')),
+)
+
+# Settings which every booking type must have.
+BOOKING_TYPE_KEYS = ('description', 'duration', 'slots', 'location',
+                     'lead_time', 'future_limit')
+
+# Booking type names appear in URLs, and are looked up from there.
+BOOKING_TYPE_NAME = re.compile(r'^[\w-]+$')
+
+# Changed whenever parsing or validation changes, so that older cache files
+# are ignored.
+CACHE_VERSION = 1
+
+class Config():
+    """
+    The options of a parsed config.ini, with the same get and has_option
+    methods as the parser. Option names are not case sensitive.
+    """
+
+    def __init__(self, sections):
+        self.sections = sections
+
+    def has_option(self, section, option):
+        return option.lower() in self.sections.get(section, {})
+
+    def get(self, section, option):
+        try:
+            return self.sections[section][option.lower()]
+        except KeyError:
+            raise ImproperlyConfigured(
+                "Option %s is missing from the [%s] block of config.ini." % (option, section))
+
+def parse(path):
+    """
+    Reads config.ini with JSONConfigParser and checks it, returning a
+    dictionary of options by block.
+    """
+    from jsonconfigparser import JSONConfigParser
+
+    parser = JSONConfigParser()
+    parser.read(path)
+
+    sections = {}
+    for section in parser.sections():
+        sections[section] = {}
+        for option in parser.options(section):
+            try:
+                sections[section][option] = parser.get(section, option)
+            except ValueError as e:
+                raise ImproperlyConfigured(
+                    "Unable to parse option %s in the [%s] block of config.ini: %s"
+                    % (option, section, e))
+
+    validate(sections)
+    return sections
+
+def validate(sections):
+    """
+    Raises ImproperlyConfigured if required options or booking type settings
+    are missing, so that mistakes show up when a worker starts rather than
+    when a page is first requested.
+    """
+    missing = [
+        '[%s] %s' % (section, option)
+        for section, options in REQUIRED for option in options
+        if option.lower() not in sections.get(section, {})
+    ]
+    if missing:
+        raise ImproperlyConfigured(
+            "Missing options in config.ini: %s." % ', '.join(missing))
+
+    booking_types = sections['meetings']['booking_types']
+    if not isinstance(booking_types, dict):
+        raise ImproperlyConfigured("BOOKING_TYPES must be a dictionary.")
+
+    for name, booking_info in booking_types.items():
+        if not BOOKING_TYPE_NAME.match(name):
+            raise ImproperlyConfigured(
+                "Booking type '%s' may only contain letters, digits, '_' and '-'." % name)
+        if not isinstance(booking_info, dict):
+            raise ImproperlyConfigured("Booking type '%s' must be a dictionary." % name)
+        missing = [ key for key in BOOKING_TYPE_KEYS if key not in booking_info ]
+        if missing:
+            raise ImproperlyConfigured(
+                "Booking type '%s' is missing %s." % (name, ', '.join(missing)))
+
+def load(path):
+    """
+    Returns the Config for the file at path. Parsed and validated options are
+    cached as JSON in path + '.cache', and reused by later worker processes
+    until config.ini is changed. The cache holds secrets, so it is only
+    readable by its owner. If it can't be written, config.ini is parsed each
+    time.
+    """
+    cache_path = path + '.cache'
+    try:
+        st    = os.stat(path)
+        stamp = [ CACHE_VERSION, st.st_mtime_ns, st.st_size ]
+    except OSError:
+        stamp = None
+
+    if stamp is not None:
+        try:
+            with open(cache_path) as f:
+                cached = json.load(f)
+            if cached['stamp'] == stamp:
+                return Config(cached['sections'])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    sections = parse(path)
+
+    if stamp is not None:
+        tmp_path = '%s.%d' % (cache_path, os.getpid())
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump({ 'stamp': stamp, 'sections': sections }, f)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass
+
+    return Config(sections)
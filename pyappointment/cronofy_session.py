@@ -0,0 +1,43 @@
+import pycronofy.exceptions
+import pycronofy.request_handler
+import pycronofy.settings
+import requests
+
+from pyappointment.settings import CRONOFY_TIMEOUT
+
+class SessionRequestHandler(pycronofy.request_handler.RequestHandler):
+    """
+    A Cronofy request handler that sends every request through one keep-alive
+    HTTP session, rather than opening a new connection for each request.
+    """
+
+    def __init__(self, auth):
+        super().__init__(auth)
+        self.session = requests.Session()
+
+    def _request(self, request_method, endpoint='', url='', data=None, params=None,
+                 use_api_key=False, omit_api_version=False):
+        if endpoint and not url:
+            base_url = getattr(self, 'base_url', pycronofy.settings.API_BASE_URL)
+            if omit_api_version:
+                url = '%s/%s' % (base_url, endpoint)
+            else:
+                url = '%s/%s/%s' % (base_url, pycronofy.settings.API_VERSION, endpoint)
+
+        headers = {
+            'Authorization': self.auth.get_api_key() if use_api_key else self.auth.get_authorization(),
+            'User-Agent': self.user_agent,
+        }
+
+        response = self.session.request(
+            request_method, url, hooks=pycronofy.settings.REQUEST_HOOK,
+            headers=headers, json=data or {}, params=params or {},
+            timeout=CRONOFY_TIMEOUT)
+
+        if response.status_code not in (200, 202):
+            try:
+                response.raise_for_status()
+            except requests.exceptions.HTTPError as e:
+                raise pycronofy.exceptions.PyCronofyRequestError(
+                    request=e.request, response=e.response)
+        return response
@@ -1,13 +1,19 @@
-import smtplib, icalendar, pytz, email
+import email
 import datetime as dt
 
 from django.template.loader import render_to_string
 from django.core.mail import EmailMultiAlternatives
 from pyappointment.settings import ORGANIZER_EMAIL, ORGANIZER_NAME, ORGANIZER_GREETING, BOOKING_TYPES, EMAIL_ADDRESS
+from pyappointment import outbox
 
-def send_organizer_email(start, finish, name, booking_type, notes, uid):
+def send_organizer_email(occurrences, name, booking_type, notes):
+    """
+    Queues the email telling the organizer about a booking. occurrences is a
+    list of (start, finish, uid) for each event booked, as for a weekly series.
+    """
     template_params = {
-        'date': start,
+        'date': occurrences[0][0],
+        'dates': [ start for start, finish, uid in occurrences ],
         'booking_info': BOOKING_TYPES[booking_type],
         'recipient': name,
         'organizer': ORGANIZER_GREETING
@@ -21,38 +27,48 @@ def send_organizer_email(start, finish, name, booking_type, notes, uid):
     )
 
     email_msg.attach_alternative(render_to_string('emails/to-organizer.html', template_params), "text/html")
-    email_msg.send()
+    outbox.enqueue(email_msg)
+
+def send_attendee_email(occurrences, name, booking_type, notes, mail_address):
+    """
+    Queues the confirmation email to the attendee, with an invitation holding
+    an event for each of the (start, finish, uid) in occurrences.
+    """
+    # icalendar is only needed here, so leave it out of worker startup.
+    import icalendar
 
-def send_attendee_email(start, finish, name, booking_type, notes, uid, mail_address):
     cal = icalendar.Calendar()
     cal.add('prodid', '-//pyappointment//pyappointment//')
     cal.add('version', '2.0')
     cal.add('method', "REQUEST")
 
-    tz         = start.tzinfo
+    tz         = occurrences[0][0].tzinfo
     mail_recip = '%s <%s>' % (name, mail_address)
+    now        = tz.localize(dt.datetime.now())
 
-    event = icalendar.Event()
-    event.add('attendee', 'MAILTO:%s' % mail_address)
-    event.add('organizer', 'MAILTO:%s' % ORGANIZER_EMAIL)
-    event.add('status', "confirmed")
-    event.add('category', "Event")
-    event.add('summary', BOOKING_TYPES[booking_type]['description'])
-    event.add('description', 'Additional notes: ' + notes)
-    event.add('location', BOOKING_TYPES[booking_type]['location'])
-    event.add('dtstart', start)
-    event.add('dtend', finish)
-    event.add('dtstamp', tz.localize(dt.datetime.now()))
-    event.add('created', tz.localize(dt.datetime.now()))
-    event.add('priority', 5)
-    event.add('sequence', 1)
+    for start, finish, uid in occurrences:
+        event = icalendar.Event()
+        event.add('attendee', 'MAILTO:%s' % mail_address)
+        event.add('organizer', 'MAILTO:%s' % ORGANIZER_EMAIL)
+        event.add('status', "confirmed")
+        event.add('category', "Event")
+        event.add('summary', BOOKING_TYPES[booking_type]['description'])
+        event.add('description', 'Additional notes: ' + notes)
+        event.add('location', BOOKING_TYPES[booking_type]['location'])
+        event.add('dtstart', start)
+        event.add('dtend', finish)
+        event.add('dtstamp', now)
+        event.add('created', now)
+        event.add('priority', 5)
+        event.add('sequence', 1)
 
-    event['uid'] = uid # Generate some unique ID
+        event['uid'] = uid # Generate some unique ID
 
-    cal.add_component(event)
+        cal.add_component(event)
 
     template_params = {
-        'date': start,
+        'date': occurrences[0][0],
+        'dates': [ start for start, finish, uid in occurrences ],
         'booking_info': BOOKING_TYPES[booking_type],
         'recipient': name,
         'organizer': ORGANIZER_GREETING
@@ -78,4 +94,4 @@ def send_attendee_email(start, finish, name, booking_type, notes, uid, mail_addr
     part.add_header("Path", filename)
     email_msg.attach(part)
 
-    email_msg.send()
+    outbox.enqueue(email_msg)
@@ -9,3 +9,16 @@ class BookingForm(forms.Form):
     notes = forms.CharField  (label      = 'Notes (optional)',
                               widget     = forms.Textarea,
                               required   = False)
+
+    def __init__(self, *args, max_weeks=1, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # Booking types may allow a series at the same time each week.
+        if max_weeks > 1:
+            self.fields['weeks'] = forms.IntegerField(
+                label     = 'Weeks',
+                min_value = 1,
+                max_value = max_weeks,
+                initial   = 1,
+                required  = False,
+                help_text = 'Book the same time each week for this many weeks.')
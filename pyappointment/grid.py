@@ -0,0 +1,120 @@
+import datetime as dt
+
+# Reason codes for the state of each slot in a WeekGrid.
+AVAILABLE     = 0
+PAST          = 1
+LEAD_TIME     = 2
+TOO_FAR       = 3
+NOT_AVAILABLE = 4
+CONFLICT      = 5
+
+class WeekGrid():
+    """
+    The slots of a week view, stored compactly. Rows start every step from
+    start (a naive local time on Monday), and columns are the days shown,
+    given as offsets in days from Monday. Each slot holds one byte of
+    reason code, so no per-slot objects exist until the template asks for
+    them.
+
+    Collapsed days and runs of unavailable rows are handled by keeping the
+    indexes of the columns and rows to show, with None marking a gap.
+    """
+
+    def __init__(self, monday, start, step, days, nrows, tz, describe=None):
+        self.monday   = monday
+        self.start    = start
+        self.step     = step
+        self.days     = days
+        self.nrows    = nrows
+        self.tz       = tz
+        self.describe = describe
+        self.codes    = bytearray([ NOT_AVAILABLE ]) * (nrows * len(days))
+
+        self.columns_shown = list(range(len(days)))
+        self.rows_shown    = []
+        self.one_available = False
+        self.expires       = None
+
+    def local_time(self, row, col):
+        """
+        Returns the naive local start time of a slot.
+        """
+        return self.start + dt.timedelta(days=self.days[col]) + row * self.step
+
+    def code(self, row, col):
+        return self.codes[row * len(self.days) + col]
+
+    def layout(self, collapse=False):
+        """
+        Works out which rows and columns to show from the codes: rows with
+        no available slot are shown as a single gap, gaps at either end are
+        dropped and, if collapse is set, so are days with no available slot.
+        """
+        ncols     = len(self.days)
+        avail_row = [ False ] * self.nrows
+        avail_col = [ False ] * ncols
+        for n, code in enumerate(self.codes):
+            if code == AVAILABLE:
+                avail_row[n // ncols] = True
+                avail_col[n % ncols]  = True
+
+        self.one_available = any(avail_col)
+        if collapse:
+            self.columns_shown = [ c for c in range(ncols) if avail_col[c] ]
+
+        rows = []
+        for row in range(self.nrows):
+            if avail_row[row]:
+                rows.append(row)
+            elif rows and rows[-1] is not None:
+                rows.append(None)
+        if rows and rows[-1] is None:
+            rows.pop()
+        self.rows_shown = rows
+
+    @property
+    def columns(self):
+        """
+        The dates of the days shown, or an empty list if there are no rows.
+        """
+        if not self.rows_shown:
+            return []
+        return [ (self.start + dt.timedelta(days=self.days[c])).date()
+                 for c in self.columns_shown ]
+
+    @property
+    def rows(self):
+        """
+        Generates the rows shown, each either 'gap' or a list of Cells.
+        """
+        for row in self.rows_shown:
+            if row is None:
+                yield 'gap'
+            else:
+                yield [ Cell(self, row, col) for col in self.columns_shown ]
+
+class Cell():
+    """
+    A view of one slot of a WeekGrid, as used by the week view template.
+    """
+    __slots__ = ('grid', 'row', 'col')
+
+    def __init__(self, grid, row, col):
+        self.grid = grid
+        self.row  = row
+        self.col  = col
+
+    @property
+    def date(self):
+        return self.grid.tz.localize(self.grid.local_time(self.row, self.col))
+
+    @property
+    def available(self):
+        return self.grid.code(self.row, self.col) == AVAILABLE
+
+    @property
+    def reason(self):
+        code = self.grid.code(self.row, self.col)
+        if self.grid.describe is None:
+            return "available" if code == AVAILABLE else "non-available time"
+        return self.grid.describe(code, self.date)
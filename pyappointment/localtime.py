@@ -0,0 +1,108 @@
+import datetime as dt
+import functools
+
+# Day number of 1970-01-01, for turning dates into epoch seconds.
+EPOCH_ORDINAL = dt.date(1970, 1, 1).toordinal()
+
+def offset_at(tz, epoch):
+    """
+    Returns the UTC offset of tz in seconds at the given epoch second.
+    """
+    return int(dt.datetime.fromtimestamp(epoch, tz).utcoffset().total_seconds())
+
+@functools.lru_cache(maxsize=1024)
+def day_offsets(tz, date):
+    """
+    Returns (midnight, offsets) for a local day in tz: the epoch second that
+    local midnight would be in UTC, and a tuple of (since, offset) pairs
+    giving the UTC offset of tz in seconds from each epoch second since (None
+    for the first) through the day. These are worked out once per day and
+    then reused, so that local times can be converted by arithmetic.
+
+    Offsets range from -12 to +14 hours, so the day lies within the 60 hours
+    checked. It is assumed that the offset never changes and changes back
+    within that time.
+    """
+    midnight    = (date.toordinal() - EPOCH_ORDINAL) * 86400
+    first, last = midnight - 14 * 3600, midnight + 36 * 3600
+
+    offsets = [ (None, offset_at(tz, first)) ]
+    if offset_at(tz, midnight + 43200) == offset_at(tz, last) == offsets[0][1]:
+        return midnight, tuple(offsets)
+
+    # Changes of offset are at least hours apart, so look for them hourly and
+    # then find the second each one happens.
+    for t in range(first + 3600, last + 3600, 3600):
+        offset = offset_at(tz, t)
+        if offset != offsets[-1][1]:
+            lo, hi = t - 3600, t
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if offset_at(tz, mid) == offsets[-1][1]:
+                    lo = mid
+                else:
+                    hi = mid
+            offsets.append((hi, offset))
+    return midnight, tuple(offsets)
+
+def day_start(tz, date):
+    """
+    Returns the epoch second of local midnight on date, if the UTC offset of
+    tz doesn't change around that day, so that the day's times can be found
+    by addition. Returns None near daylight saving changes.
+    """
+    midnight, offsets = day_offsets(tz, date)
+    if len(offsets) > 1:
+        return None
+    return midnight - offsets[0][1]
+
+def to_epoch(tz, date, seconds):
+    """
+    Returns the epoch second of the local time seconds after midnight on date
+    in tz, as tz.localize would. Times which fall in the hour skipped or
+    repeated by a daylight saving change are left to tz.localize.
+    """
+    midnight, offsets = day_offsets(tz, date)
+    local = midnight + seconds
+    if len(offsets) == 1:
+        return local - offsets[0][1]
+
+    # Use the offset under which this local time actually occurs, if there
+    # is exactly one.
+    found = [
+        local - offset for n, (since, offset) in enumerate(offsets)
+        if (since is None or local - offset >= since) and
+           (n + 1 == len(offsets) or local - offset < offsets[n + 1][0])
+    ]
+    if len(found) == 1:
+        return found[0]
+    return int(tz.localize(dt.datetime.combine(date, dt.time())
+                           + dt.timedelta(seconds=seconds)).timestamp())
+
+def parse_iso(iso_str, tz):
+    """
+    Converts an ISO 8601 time from Cronofy to integer seconds since the epoch.
+    Cronofy gives times in UTC as YYYY-MM-DDTHH:MM:SSZ, possibly with
+    milliseconds, and the dates of all-day events as YYYY-MM-DD, which are
+    taken to be in tz. These are parsed by slicing, and anything else is left
+    to dateutil.
+    """
+    n = len(iso_str)
+    try:
+        if iso_str[4:5] == '-' and iso_str[7:8] == '-':
+            date = dt.date(int(iso_str[0:4]), int(iso_str[5:7]), int(iso_str[8:10]))
+            if n == 10:
+                return to_epoch(tz, date, 0)
+            if (n == 20 or (n == 24 and iso_str[19] == '.')) and iso_str[-1] == 'Z' and \
+                    iso_str[10] == 'T' and iso_str[13] == ':' and iso_str[16] == ':':
+                return (date.toordinal() - EPOCH_ORDINAL) * 86400 + \
+                    int(iso_str[11:13]) * 3600 + int(iso_str[14:16]) * 60 + int(iso_str[17:19])
+    except ValueError:
+        pass
+
+    import dateutil.parser
+
+    tmp = dateutil.parser.parse(iso_str)
+    if tmp.tzinfo is None:
+        tmp = tz.localize(tmp)
+    return int(tmp.timestamp())
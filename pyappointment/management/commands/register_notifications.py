@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from pyappointment import calendar_link, settings
+
+class Command(BaseCommand):
+    help = 'Asks Cronofy to send change notifications for the checked calendars.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'base_url',
+            help='Public URL of this site, e.g. https://book.example.com')
+
+    def handle(self, *args, **options):
+        if not settings.CRONOFY_NOTIFICATION_TOKEN:
+            raise CommandError('Set NOTIFICATION_TOKEN in the [cronofy] block first.')
+
+        callback_url = '%s/cronofy/notify/%s' % (
+            options['base_url'].rstrip('/'), settings.CRONOFY_NOTIFICATION_TOKEN)
+
+        handle  = calendar_link.connect_calendar()
+        channel = handle.create_notification_channel(
+            callback_url, calendar_ids=calendar_link.calendar_ids(handle)[0])
+
+        self.stdout.write('Registered channel %s for %s.' % (
+            channel['channel_id'], callback_url))
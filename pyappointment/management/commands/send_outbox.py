@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from pyappointment import outbox
+
+class Command(BaseCommand):
+    help = 'Sends booking emails waiting in the outbox.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', type=int, metavar='SECONDS', default=0,
+            help='Keep running, checking the outbox every SECONDS seconds.')
+
+    def handle(self, *args, **options):
+        while True:
+            sent = outbox.send_pending()
+            if sent:
+                self.stdout.write('Sent %d message%s.' % (sent, '' if sent == 1 else 's'))
+
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
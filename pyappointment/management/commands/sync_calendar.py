@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from pyappointment import mirror
+
+class Command(BaseCommand):
+    help = 'Synchronises the local mirror of the checked calendars with Cronofy.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Read every event again, rather than only those that have changed.')
+        parser.add_argument(
+            '--loop', type=int, metavar='SECONDS', default=0,
+            help='Keep running, synchronising every SECONDS seconds.')
+
+    def handle(self, *args, **options):
+        full = options['full']
+        while True:
+            started = time.perf_counter()
+            count   = mirror.sync(full=full)
+            self.stdout.write('Synchronised %d event%s in %.2fs.' % (
+                count, '' if count == 1 else 's', time.perf_counter() - started))
+
+            if not options['loop']:
+                break
+            full = False
+            time.sleep(options['loop'])
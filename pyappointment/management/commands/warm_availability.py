@@ -0,0 +1,53 @@
+import datetime as dt
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pyappointment import calendar_link, settings, views
+
+class Command(BaseCommand):
+    help = 'Fills the shared cache with calendar data and week views for every booking type.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--weeks', type=int, default=4,
+            help='Number of weeks to warm, if a booking type\'s future limit allows.')
+
+    def handle(self, *args, **options):
+        if not settings.CACHE_SHARED_FILE:
+            raise CommandError(
+                'Set SHARED_FILE in the [cache] block, so that the web server can '
+                'use the cache filled by this command.')
+
+        now    = dt.datetime.now(views.LOCALTZ)
+        monday = views.get_monday(now)
+
+        # Work out how many weeks each booking type can show.
+        weeks = {}
+        for booking_type, booking_info in settings.BOOKING_TYPES.items():
+            count = options['weeks']
+            if booking_info['future_limit'] != 0:
+                limit = now + dt.timedelta(days=booking_info['future_limit'])
+                count = min(count, (limit - monday).days // 7 + 1)
+            weeks[booking_type] = count
+
+        # Calendar data is the same for every booking type, so is read once
+        # for the longest range.
+        started = time.perf_counter()
+        try:
+            events = calendar_link.warm(monday, max(weeks.values(), default=0))
+        except calendar_link.CalendarUnavailable as e:
+            raise CommandError(str(e))
+        self.stdout.write('Read %d event%s in %.2fs.' % (
+            events, '' if events == 1 else 's', time.perf_counter() - started))
+
+        for booking_type, count in weeks.items():
+            started = time.perf_counter()
+            for week in range(count):
+                # The same date view_week would ask for, 09:00 on the Monday.
+                day = monday.date() + dt.timedelta(days=7 * week)
+                views.week_page(booking_type,
+                                views.LOCALTZ.localize(dt.datetime.combine(day, dt.time(9))))
+            self.stdout.write('Warmed %d week%s of %s in %.2fs.' % (
+                count, '' if count == 1 else 's', booking_type,
+                time.perf_counter() - started))
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:47
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pyappointment', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MirroredEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calendar_id', models.CharField(max_length=255)),
+                ('event_uid', models.CharField(max_length=255)),
+                ('start', models.BigIntegerField(db_index=True)),
+                ('end', models.BigIntegerField(db_index=True)),
+                ('summary', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MirrorState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calendar_ids', models.TextField()),
+                ('window_start', models.BigIntegerField()),
+                ('window_end', models.BigIntegerField()),
+                ('last_modified', models.DateTimeField()),
+                ('synced', models.DateTimeField()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='mirroredevent',
+            unique_together=set([('calendar_id', 'event_uid')]),
+        ),
+    ]
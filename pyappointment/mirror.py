@@ -0,0 +1,144 @@
+import datetime as dt
+import pytz
+
+from django.db import transaction
+
+from pyappointment import calendar_link
+from pyappointment.models import MirroredEvent, MirrorState
+from pyappointment.settings import TIME_ZONE, MIRROR_DAYS, MIRROR_MAX_AGE
+
+LOCALTZ = pytz.timezone(TIME_ZONE)
+
+# Allowance for clock differences between this server and Cronofy when asking
+# for the changes made since the last sync.
+CLOCK_SKEW = dt.timedelta(minutes=5)
+
+def event_key(event):
+    """
+    Returns the key identifying an event in the mirror. Events created by
+    PyAppointment are keyed by the event_id it gave them, so that bookings can
+    be added to the mirror before they are synchronised back from Cronofy.
+    """
+    return event.get('event_id') or event['event_uid']
+
+def current_state():
+    return MirrorState.objects.filter(pk=1).first()
+
+def covers(cal_ids, start, finish):
+    """
+    Returns True if the mirror holds recently synchronised events for the
+    calendars cal_ids between start and finish, given as epoch seconds.
+    """
+    state = current_state()
+    if state is None or state.calendar_ids != '\n'.join(sorted(cal_ids)):
+        return False
+    if dt.datetime.utcnow() - state.synced > dt.timedelta(seconds=MIRROR_MAX_AGE):
+        return False
+    return state.window_start <= start and finish <= state.window_end
+
+def busy(cal_ids, start, finish):
+    """
+    Returns a BusyIndex of the mirrored events between start and finish, given
+    as epoch seconds.
+    """
+    return calendar_link.BusyIndex(list(
+        MirroredEvent.objects.filter(
+            calendar_id__in=cal_ids, start__lt=finish, end__gt=start
+        ).values_list('start', 'end', 'summary')
+    ))
+
+def add_event(calendar_id, key, start, finish, summary):
+    """
+    Adds or updates a single event in the mirror, with start and finish given
+    as epoch seconds.
+    """
+    MirroredEvent.objects.update_or_create(
+        calendar_id=calendar_id, event_uid=key,
+        defaults={ 'start': start, 'end': finish, 'summary': summary })
+
+def apply_events(events):
+    """
+    Applies events read from Cronofy to the mirror, removing any that have
+    been deleted. Returns the previous (start, end) of each mirrored event
+    that was changed or removed.
+    """
+    previous = []
+    with transaction.atomic():
+        for event in events:
+            found = MirroredEvent.objects.filter(
+                calendar_id=event['calendar_id'], event_uid=event_key(event))
+            previous.extend(found.values_list('start', 'end'))
+
+            if event.get('deleted'):
+                found.delete()
+            else:
+                add_event(event['calendar_id'], event_key(event),
+                          calendar_link.parse_event_time(event['start'], LOCALTZ),
+                          calendar_link.parse_event_time(event['end'], LOCALTZ),
+                          event.get('summary', ''))
+    return previous
+
+def sync(handle=None, full=False):
+    """
+    Brings the mirror up to date with the checked calendars, covering the
+    period from the Monday of last week to MIRROR_DAYS days ahead. After the
+    first full read, only events modified since the previous sync are
+    fetched, along with any days that have come into the window since then.
+    Returns the number of events read.
+    """
+    if handle is None:
+        handle = calendar_link.connect_calendar()
+
+    cal_ids = sorted(calendar_link.calendar_ids(handle)[0])
+    started = dt.datetime.utcnow()
+
+    # Start from the Monday of last week, so that the week views for this
+    # week and the one before, which read from Monday, are covered.
+    today = dt.datetime.now(LOCALTZ).date()
+    first = today - dt.timedelta(days=today.weekday() + 7)
+    window_start, window_end = calendar_link.utc_range(
+        LOCALTZ.localize(dt.datetime.combine(first, dt.time())),
+        dt.timedelta((today - first).days + MIRROR_DAYS))
+
+    state = current_state()
+    full  = full or state is None or state.calendar_ids != '\n'.join(cal_ids)
+
+    # Work out what to read: either everything, or the changes since the last
+    # sync plus any new days.
+    if full:
+        reads = [ (window_start, window_end, {}) ]
+    else:
+        reads = [ (window_start, window_end, {
+            'last_modified': pytz.utc.localize(state.last_modified),
+            'include_deleted': True,
+            'include_moved': True,
+        }) ]
+        if calendar_link.to_timestamp(window_end) > state.window_end:
+            covered = dt.datetime.fromtimestamp(state.window_end, pytz.utc)
+            reads.append((max(covered, window_start), window_end, {}))
+
+    # Fetch before writing, so the database isn't locked during API calls.
+    events = []
+    for start, finish, options in reads:
+        events.extend(handle.read_events(
+            calendar_ids=cal_ids, from_date=start, to_date=finish, **options).all())
+
+    with transaction.atomic():
+        if full:
+            MirroredEvent.objects.all().delete()
+
+        apply_events(events)
+
+        # Forget events that have finished before the window.
+        MirroredEvent.objects.filter(end__lte=calendar_link.to_timestamp(window_start)).delete()
+
+        MirrorState(
+            pk=1,
+            calendar_ids='\n'.join(cal_ids),
+            window_start=calendar_link.to_timestamp(window_start),
+            window_end=calendar_link.to_timestamp(window_end),
+            last_modified=started - CLOCK_SKEW,
+            synced=started
+        ).save()
+
+    return len(events)
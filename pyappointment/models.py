@@ -0,0 +1,59 @@
+import datetime as dt
+
+from django.db import models
+
+from pyappointment.settings import EMAIL_RETRY_DELAY
+
+class OutboxMessage(models.Model):
+    """
+    A rendered email waiting to be sent by the outbox.
+    """
+
+    sender       = models.CharField(max_length=254)
+    recipients   = models.TextField()
+    message      = models.BinaryField()
+    created      = models.DateTimeField(auto_now_add=True)
+    next_attempt = models.DateTimeField(db_index=True)
+    attempts     = models.IntegerField(default=0)
+    last_error   = models.TextField(blank=True)
+
+    def recipient_list(self):
+        return self.recipients.split('\n')
+
+    def schedule_retry(self, error):
+        """
+        Records a failed attempt to send this message, and schedules the next
+        attempt with exponential backoff, capped at one day.
+        """
+        self.attempts    += 1
+        self.last_error   = error
+        delay             = min(EMAIL_RETRY_DELAY * 2 ** (self.attempts - 1), 86400)
+        self.next_attempt = dt.datetime.now() + dt.timedelta(seconds=delay)
+        self.save()
+
+class MirroredEvent(models.Model):
+    """
+    An event copied from one of the checked calendars into the local mirror.
+    Times are stored as epoch seconds.
+    """
+
+    calendar_id = models.CharField(max_length=255)
+    event_uid   = models.CharField(max_length=255)
+    start       = models.BigIntegerField(db_index=True)
+    end         = models.BigIntegerField(db_index=True)
+    summary     = models.TextField(blank=True)
+
+    class Meta:
+        unique_together = ('calendar_id', 'event_uid')
+
+class MirrorState(models.Model):
+    """
+    Records how far the local mirror has been synchronised. There is only ever
+    one row.
+    """
+
+    calendar_ids  = models.TextField()
+    window_start  = models.BigIntegerField()
+    window_end    = models.BigIntegerField()
+    last_modified = models.DateTimeField()
+    synced        = models.DateTimeField()
@@ -0,0 +1,162 @@
+import datetime as dt
+import email
+import email.message
+import logging
+import threading
+
+from django.core.mail import EmailMessage, get_connection
+from django.core.mail.message import sanitize_address
+from django.db import connection as db_connection
+
+from pyappointment.models import OutboxMessage
+from pyappointment.timing import timed
+from pyappointment.settings import EMAIL_SEND_IN_BACKGROUND, EMAIL_BATCH_SIZE, \
+    EMAIL_MAX_ATTEMPTS
+
+logger = logging.getLogger(__name__)
+
+# How long a sender may hold a claimed message before others can retry it, in
+# seconds.
+CLAIM_TIMEOUT = 600
+
+# How often the background sender looks for messages that are due a retry.
+POLL_INTERVAL = 60
+
+_wakeup      = threading.Event()
+_sender      = None
+_sender_lock = threading.Lock()
+
+class StoredMIMEMessage(email.message.Message):
+    """
+    A message parsed back from the outbox, which can be rendered with a given
+    line separator like Django's own MIME classes.
+    """
+
+    def as_bytes(self, unixfrom=False, linesep='\n'):
+        return super().as_bytes(unixfrom, policy=self.policy.clone(linesep=linesep))
+
+class StoredEmail(EmailMessage):
+    """
+    An EmailMessage for a message stored in the outbox, which the configured
+    email backend sends as it was rendered.
+    """
+
+    def __init__(self, msg):
+        self.stored = email.message_from_bytes(bytes(msg.message), _class=StoredMIMEMessage)
+        super().__init__(subject=self.stored['Subject'] or '',
+                         from_email=msg.sender, to=msg.recipient_list())
+
+    def message(self):
+        return self.stored
+
+def enqueue(email_msg):
+    """
+    Stores a rendered EmailMessage in the outbox, and wakes the background
+    sender if it is enabled.
+    """
+    encoding = email_msg.encoding or 'utf-8'
+    OutboxMessage.objects.create(
+        sender=sanitize_address(email_msg.from_email, encoding),
+        recipients='\n'.join(
+            sanitize_address(addr, encoding) for addr in email_msg.recipients()),
+        message=email_msg.message().as_bytes(linesep='\r\n'),
+        next_attempt=dt.datetime.now()
+    )
+
+    if EMAIL_SEND_IN_BACKGROUND:
+        wake_sender()
+
+def claim_batch(size):
+    """
+    Returns up to size messages that are due to be sent, pushing back their
+    next attempt so that no other sender picks them up concurrently.
+    """
+    now   = dt.datetime.now()
+    batch = []
+
+    due = OutboxMessage.objects.filter(
+        next_attempt__lte=now, attempts__lt=EMAIL_MAX_ATTEMPTS).order_by('next_attempt')
+
+    for msg in due[:size]:
+        claimed = now + dt.timedelta(seconds=CLAIM_TIMEOUT)
+        if OutboxMessage.objects.filter(
+                pk=msg.pk, next_attempt=msg.next_attempt).update(next_attempt=claimed):
+            msg.next_attempt = claimed
+            batch.append(msg)
+
+    return batch
+
+def send_pending(batch_size=EMAIL_BATCH_SIZE):
+    """
+    Sends all messages in the outbox that are due, in batches over a single
+    connection to the email backend. Failed messages are scheduled for a
+    retry, until they have used up EMAIL_MAX_ATTEMPTS. Returns the number of
+    messages sent.
+    """
+    connection = None
+    sent       = 0
+
+    try:
+        while True:
+            batch = claim_batch(batch_size)
+            if not batch:
+                break
+
+            for msg in batch:
+                try:
+                    with timed('smtp'):
+                        if connection is None:
+                            connection = get_connection()
+                            connection.open()
+                        if not connection.send_messages([ StoredEmail(msg) ]):
+                            raise RuntimeError("The email backend did not send the message")
+                except Exception as e:
+                    logger.warning("Unable to send outbox message %d: %s", msg.pk, e)
+                    msg.schedule_retry(str(e))
+                    if msg.attempts >= EMAIL_MAX_ATTEMPTS:
+                        logger.error("Giving up on outbox message %d to %s after %d attempts",
+                                     msg.pk, ', '.join(msg.recipient_list()), msg.attempts)
+
+                    # Start again with a new connection for the next message.
+                    if connection is not None:
+                        try:
+                            connection.close()
+                        except Exception:
+                            pass
+                        connection = None
+                    continue
+
+                msg.delete()
+                sent += 1
+    finally:
+        if connection is not None:
+            connection.close()
+
+    return sent
+
+def wake_sender():
+    """
+    Starts the background sender thread if it isn't running, and asks it to
+    drain the outbox.
+    """
+    global _sender
+    with _sender_lock:
+        if _sender is None or not _sender.is_alive():
+            _sender = threading.Thread(
+                target=_sender_loop, name='outbox-sender', daemon=True)
+            _sender.start()
+    _wakeup.set()
+
+def _sender_loop():
+    while True:
+        _wakeup.wait(POLL_INTERVAL)
+        _wakeup.clear()
+
+        try:
+            send_pending()
+        except Exception:
+            logger.exception("Outbox sender failed")
+        finally:
+            # This thread has its own database connection; don't hold it open
+            # while idle.
+            db_connection.close()
@@ -0,0 +1,183 @@
+import collections
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+from django.utils.crypto import constant_time_compare
+
+from pyappointment.settings import PROFILE_DIRECTORY, PROFILE_TOKEN, PROFILE_SAMPLE_RATE, \
+    PROFILE_MAX_FILES, PROFILE_MAX_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Only views in this module are profiled.
+VIEWS_MODULE = 'pyappointment.views'
+
+# Paths in stacks are shortened by removing the longest of these prefixes.
+PATH_PREFIXES = sorted((os.path.join(p, '') for p in sys.path if p), key=len, reverse=True)
+
+# Paths through the call graph taking less than this many seconds are left out.
+MIN_TIME = 1e-6
+
+# Held while a view is being profiled, so that each worker profiles one
+# request at a time.
+_lock = threading.Lock()
+
+def requested(request):
+    """
+    Returns whether profiling was asked for with the profile token, given in
+    an X-Profile header or a profile query parameter, or picked at random at
+    PROFILE_SAMPLE_RATE.
+    """
+    token = request.META.get('HTTP_X_PROFILE') or request.GET.get('profile')
+    if token and PROFILE_TOKEN and constant_time_compare(token, PROFILE_TOKEN):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def label(func):
+    """
+    Returns the name of a function in a profile as path:name:line, with the
+    path relative to sys.path.
+    """
+    filename, lineno, name = func
+    if filename == '~':
+        return name.replace(';', ',')
+    for prefix in PATH_PREFIXES:
+        if filename.startswith(prefix):
+            filename = filename[len(prefix):]
+            break
+    return ('%s:%s:%d' % (filename, name, lineno)).replace(';', ',')
+
+def collapse(stats):
+    """
+    Turns the stats of a pstats.Stats into collapsed stacks, as read by
+    flamegraph.pl and speedscope: a dict of semicolon-separated stacks to the
+    microseconds spent in the last function of each. cProfile only records
+    time by caller, so where a function is called from several stacks, the
+    time of each call from a caller is shared between them in proportion.
+    """
+    callees = collections.defaultdict(list)
+    for func, (cc, nc, tt, ct, callers) in stats.items():
+        for caller, (c_cc, c_nc, c_tt, c_ct) in callers.items():
+            callees[caller].append((func, c_ct))
+
+    stacks = collections.Counter()
+
+    def walk(func, funcs, names, total):
+        share = total / stats[func][3] if stats[func][3] else 0
+        stacks[';'.join(names)] += stats[func][2] * share
+        for callee, c_ct in callees[func]:
+            if callee not in funcs and c_ct * share >= MIN_TIME:
+                walk(callee, funcs | { callee }, names + [ label(callee) ], c_ct * share)
+
+    for func, (cc, nc, tt, ct, callers) in stats.items():
+        if not any(caller in stats for caller in callers):
+            walk(func, { func }, [ label(func) ], ct)
+
+    return { stack: int(round(t * 1e6)) for stack, t in stacks.items() if t >= 5e-7 }
+
+def rotate(directory):
+    """
+    Removes the oldest profiles from directory until at most
+    PROFILE_MAX_FILES are left, taking at most PROFILE_MAX_SIZE megabytes.
+    """
+    profiles = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.collapsed'):
+            st = entry.stat()
+            profiles.append((st.st_mtime, entry.path, st.st_size))
+    profiles.sort()
+
+    total = sum(size for mtime, path, size in profiles)
+    while profiles and (len(profiles) > PROFILE_MAX_FILES or
+                        total > PROFILE_MAX_SIZE * 1024 * 1024):
+        mtime, path, size = profiles.pop(0)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+def write_profile(profiler, path):
+    """
+    Writes the collapsed stacks of a finished cProfile.Profile to path, then
+    rotates the profile directory.
+    """
+    import pstats
+
+    try:
+        stacks = collapse(pstats.Stats(profiler).stats)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            for stack, count in sorted(stacks.items()):
+                if count > 0:
+                    f.write('%s %d\n' % (stack, count))
+        os.replace(path + '.tmp', path)
+        rotate(os.path.dirname(path))
+    except OSError as e:
+        logger.warning("Unable to write profile %s: %s", path, e)
+
+def profiled_content(profiler, content, path):
+    """
+    Profiles the generation of a streamed response, as it is sent, then
+    writes the profile.
+    """
+    content = iter(content)
+    while True:
+        profiler.enable()
+        try:
+            chunk = next(content)
+        except StopIteration:
+            break
+        finally:
+            profiler.disable()
+        yield chunk
+    write_profile(profiler, path)
+
+class ProfileMiddleware():
+    """
+    Runs requests to the views under cProfile when asked to, and writes each
+    profile to PROFILE_DIRECTORY as collapsed stacks. This includes the time
+    spent in calendar_link and rendering templates. The name of the profile
+    is returned in an X-Profile response header.
+
+    This must be the last middleware, so that the others have seen the
+    request before the view is run here.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not PROFILE_DIRECTORY or view_func.__module__ != VIEWS_MODULE:
+            return None
+        if not requested(request) or not _lock.acquire(blocking=False):
+            return None
+
+        import cProfile
+
+        now  = time.time()
+        name = '%s.%03d-%d-%s.collapsed' % (
+            time.strftime('%Y%m%d-%H%M%S', time.gmtime(now)), int(now * 1000) % 1000,
+            os.getpid(), view_func.__name__)
+        path = os.path.join(PROFILE_DIRECTORY, name)
+
+        profiler = cProfile.Profile()
+        try:
+            response = profiler.runcall(view_func, request, *view_args, **view_kwargs)
+        finally:
+            _lock.release()
+
+        response['X-Profile'] = name
+        if response.streaming:
+            response.streaming_content = profiled_content(
+                profiler, response.streaming_content, path)
+        else:
+            write_profile(profiler, path)
+        return response
@@ -1,6 +1,7 @@
-from jsonconfigparser import JSONConfigParser
 import os, json
 
+from pyappointment import configfile
+
 ##
 ## Set up Django application settings
 ##
@@ -18,9 +19,11 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'compressor',
     'bootstrapform',
+    'pyappointment',
 ]
 
 MIDDLEWARE = [
+    'pyappointment.timing.TimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -28,6 +31,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'pyappointment.profiling.ProfileMiddleware',
 ]
 
 ROOT_URLCONF = 'pyappointment.urls'
@@ -121,8 +125,20 @@ STATIC_URL = '/static/'
 ## Import site-specifc stuff from config.ini.
 ##
 
-config = JSONConfigParser()
-config.read(os.path.join(BASE_DIR, "config.ini"))
+# The PYAPPOINTMENT_CONFIG environment variable may point at another file.
+CONFIG_FILE = os.environ.get(
+    "PYAPPOINTMENT_CONFIG", os.path.join(BASE_DIR, "config.ini"))
+
+# Parsed and checked once, then cached until config.ini changes.
+config = configfile.load(CONFIG_FILE)
+
+def config_get(section, option, default):
+    """
+    Returns an optional setting from config.ini, or default if it isn't set.
+    """
+    if config.has_option(section, option):
+        return config.get(section, option)
+    return default
 
 # Django [django] block
 SECRET_KEY = config.get('django', 'SECRET_KEY')
@@ -143,9 +159,18 @@ EMAIL_HOST = config.get('email', 'HOST')
 EMAIL_PORT = config.get('email', 'PORT')
 EMAIL_HOST_USER = config.get('email', 'HOST_USER')
 EMAIL_HOST_PASSWORD = config.get('email', 'HOST_PASSWORD')
+EMAIL_SEND_IN_BACKGROUND = config_get('email', 'SEND_IN_BACKGROUND', True)
+EMAIL_BATCH_SIZE = config_get('email', 'BATCH_SIZE', 20)
+EMAIL_MAX_ATTEMPTS = config_get('email', 'MAX_ATTEMPTS', 8)
+EMAIL_RETRY_DELAY = config_get('email', 'RETRY_DELAY', 60)
 
 # Cronofy settings
 CRONOFY_ACCESS_TOKEN = config.get('cronofy', 'ACCESS_TOKEN')
+CRONOFY_TIMEOUT = config_get('cronofy', 'TIMEOUT', 10)
+CRONOFY_FAILURE_THRESHOLD = config_get('cronofy', 'FAILURE_THRESHOLD', 3)
+CRONOFY_RETRY_AFTER = config_get('cronofy', 'RETRY_AFTER', 30)
+CRONOFY_CONCURRENCY = config_get('cronofy', 'CONCURRENCY', 4)
+CRONOFY_NOTIFICATION_TOKEN = config_get('cronofy', 'NOTIFICATION_TOKEN', '')
 
 # Calendar names
 CAL_NAMES = config.get("calendar", "CHECK")
@@ -159,3 +184,28 @@ AVAIL_CONFIG_STRINGS = [
     config.get('availability', day) for day in (
         'MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT', 'SUN')
 ]
+
+# Caching of calendar data
+CALENDAR_CACHE_TTL = config_get("cache", "CALENDAR_TTL", 300)
+CALENDAR_CACHE_SIZE = config_get("cache", "CALENDAR_SIZE", 64)
+CALENDAR_STALE_TTL = config_get("cache", "CALENDAR_STALE_TTL", 3600)
+CALENDAR_LIST_TTL = config_get("cache", "CALENDAR_LIST_TTL", 3600)
+CACHE_SHARED_FILE = config_get("cache", "SHARED_FILE", "")
+CALENDAR_PREFETCH = config_get("cache", "PREFETCH", True)
+CALENDAR_PREFETCH_WORKERS = config_get("cache", "PREFETCH_WORKERS", 2)
+CALENDAR_PREFETCH_LIMIT = config_get("cache", "PREFETCH_LIMIT", 4)
+
+# Local mirror of the checked calendars
+MIRROR_ENABLED = config_get("mirror", "ENABLED", False)
+MIRROR_DAYS = config_get("mirror", "DAYS", 90)
+MIRROR_MAX_AGE = config_get("mirror", "MAX_AGE", 900)
+
+# Request timing
+TIMING_STATS = config_get("timing", "STATS", False)
+
+# Profiling of requests
+PROFILE_DIRECTORY = config_get("profile", "DIRECTORY", "")
+PROFILE_TOKEN = config_get("profile", "TOKEN", "")
+PROFILE_SAMPLE_RATE = config_get("profile", "SAMPLE_RATE", 0)
+PROFILE_MAX_FILES = config_get("profile", "MAX_FILES", 100)
+PROFILE_MAX_SIZE = config_get("profile", "MAX_SIZE", 20)
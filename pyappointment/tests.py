@@ -0,0 +1,283 @@
+import datetime as dt
+import email
+import json
+from unittest import mock
+
+import pytz
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.test import TestCase
+
+from benchmarks.fake_cronofy import FakeCalendar, FakeClient, format_time
+from pyappointment import availability, calendar_link, mirror, outbox, settings, views
+from pyappointment.models import MirroredEvent, OutboxMessage
+
+TOKEN = 'test-notification-token'
+
+# Booking types used in place of the site's, open every day so that there
+# is always a free slot whatever the date.
+BOOKING_TYPES = {
+    'meeting': {
+        'description': 'Meeting',
+        'duration': 30,
+        'slots': 30,
+        'location': 'Office',
+        'lead_time': 0,
+        'future_limit': 0,
+        'hidden': False,
+    },
+    'series': {
+        'description': 'Weekly meeting',
+        'duration': 60,
+        'slots': 30,
+        'location': 'Office',
+        'lead_time': 0,
+        'future_limit': 0,
+        'hidden': False,
+        'max_weeks': 4,
+    },
+}
+AVAILABILITY = '08:00-20:00'
+
+class FakeCronofyTestCase(TestCase):
+    """
+    Serves the calendars named in config.ini from the stand-in client from
+    the benchmarks, and replaces the site's booking types and availability
+    with BOOKING_TYPES and AVAILABILITY.
+    """
+
+    def setUp(self):
+        weekly = [ availability.Availability.from_config(AVAILABILITY) ] * len(availability.DAYS)
+        for patcher in (
+            mock.patch.object(settings, 'CRONOFY_NOTIFICATION_TOKEN', TOKEN),
+            mock.patch.object(settings, 'CALENDAR_PREFETCH', False),
+            mock.patch.object(outbox, 'EMAIL_SEND_IN_BACKGROUND', False),
+            mock.patch.object(availability, 'MEETING_AVAIL', weekly),
+            mock.patch.dict(settings.BOOKING_TYPES, BOOKING_TYPES, clear=True),
+            mock.patch.dict(availability.BOOKING_RULES, {
+                name: availability.BookingRules(weekly, {}) for name in BOOKING_TYPES
+            }, clear=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        names = sorted(set(settings.CAL_NAMES) | { settings.CAL_CREATE_BOOKING })
+        start = dt.date.today() - dt.timedelta(days=7)
+        self.cronofy = FakeClient([
+            FakeCalendar('cal_%d' % n, name, views.LOCALTZ, start, 60, density=2, seed=n)
+            for n, name in enumerate(names)
+        ])
+        self.calendar = self.cronofy.calendars['cal_%d' % names.index(settings.CAL_NAMES[0])]
+        self.book_calendar = self.cronofy.calendars[
+            'cal_%d' % names.index(settings.CAL_CREATE_BOOKING)]
+        calendar_link.use_client(self.cronofy)
+        self.addCleanup(calendar_link.use_client, None)
+
+    def free_slot(self, booking_type='meeting'):
+        """
+        Returns the start and finish of the next free slot of booking_type.
+        """
+        start = views.next_available(booking_type, dt.datetime.now(views.LOCALTZ))
+        self.assertIsNotNone(start)
+        duration = settings.BOOKING_TYPES[booking_type]['duration']
+        return start, start + dt.timedelta(minutes=duration)
+
+class CronofyNotificationTests(FakeCronofyTestCase):
+    """
+    Posts notifications as Cronofy would to the notification view.
+    """
+
+    def notify(self, body, token=TOKEN):
+        return self.client.post('/cronofy/notify/%s' % token, body,
+                                content_type='application/json')
+
+    def notify_change(self, since):
+        return self.notify(json.dumps({ 'notification': {
+            'type': 'change',
+            'changes_since': since.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        } }))
+
+    def cached_over(self, start, finish):
+        start, finish = calendar_link.to_timestamp(start), calendar_link.to_timestamp(finish)
+        return [ key for key in calendar_link.busy_cache.keys()
+                 if key[1] < finish and key[2] > start ]
+
+    def test_verification(self):
+        response = self.notify(json.dumps({ 'notification': { 'type': 'verification' } }))
+        self.assertEqual(response.status_code, 204)
+
+    def test_unknown_token(self):
+        response = self.notify(json.dumps({ 'notification': { 'type': 'verification' } }),
+                               token='wrong-token')
+        self.assertEqual(response.status_code, 404)
+
+    def test_malformed(self):
+        for body in ('not json', '{}', json.dumps({ 'notification': { 'type': 'change' } }),
+                     json.dumps({ 'notification': { 'type': 'change',
+                                                    'changes_since': 'yesterday' } })):
+            self.assertEqual(self.notify(body).status_code, 400, body)
+
+    def test_change_invalidates_week(self):
+        start, finish = self.free_slot()
+        url  = '/meeting/%s' % start.strftime('%Y-%m-%d')
+        etag = self.client.get(url)['ETag']
+        self.assertTrue(self.cached_over(start, finish))
+
+        since = dt.datetime.now(pytz.utc)
+        self.calendar.add_event(format_time(start), format_time(finish), 'Added')
+
+        response = self.notify_change(since)
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(self.cached_over(start, finish))
+        self.assertNotEqual(self.client.get(url)['ETag'], etag)
+
+    @mock.patch.object(calendar_link, 'MIRROR_ENABLED', True)
+    def test_change_updates_mirror(self):
+        mirror.sync(self.cronofy)
+
+        start, finish = self.free_slot()
+        now     = calendar_link.to_timestamp(dt.datetime.now(pytz.utc))
+        removed = next(e for e, (e_start, e_end) in zip(self.calendar.events, self.calendar.times)
+                       if e_start > now)
+        self.assertTrue(MirroredEvent.objects.filter(event_uid=removed['event_uid']).exists())
+
+        since = dt.datetime.now(pytz.utc)
+        self.calendar.add_event(format_time(start), format_time(finish), 'Added', 'added')
+        self.cronofy.delete_event(self.calendar.calendar_id, removed['event_uid'])
+
+        response = self.notify_change(since)
+        self.assertEqual(response.status_code, 204)
+
+        added = MirroredEvent.objects.get(event_uid='added')
+        self.assertEqual((added.start, added.end),
+                         (calendar_link.to_timestamp(start), calendar_link.to_timestamp(finish)))
+        self.assertFalse(MirroredEvent.objects.filter(event_uid=removed['event_uid']).exists())
+        self.assertNotEqual(views.next_available('meeting', start), start)
+
+@mock.patch.object(calendar_link, 'MIRROR_ENABLED', True)
+class MirrorTests(FakeCronofyTestCase):
+    """
+    Shows week views from the local mirror of the calendars.
+    """
+
+    def test_weeks_from_mirror(self):
+        mirror.sync(self.cronofy)
+        calls = self.cronofy.calls
+
+        today = dt.date.today()
+        for weeks in (-1, 0, 1):
+            day = today + dt.timedelta(weeks=weeks)
+            self.assertEqual(
+                self.client.get('/meeting/%s' % day.strftime('%Y-%m-%d')).status_code, 200)
+        self.assertEqual(self.cronofy.calls, calls)
+
+class BookingSeriesTests(FakeCronofyTestCase):
+    """
+    Books weekly series through the booking form.
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        # Start from empty calendars, so that every week of a series is free.
+        for calendar in self.cronofy.calendars.values():
+            calendar.events, calendar.times, calendar.modified = [], [], []
+
+        day         = dt.date.today() + dt.timedelta(days=1)
+        self.starts = [ views.LOCALTZ.localize(dt.datetime.combine(
+            day + dt.timedelta(weeks=n), dt.time(10))) for n in range(3) ]
+        self.url    = self.starts[0].strftime('/book/series/%Y-%m-%d/%H-%M')
+
+    def book(self):
+        return self.client.post(self.url, {
+            'name': 'Attendee', 'email': 'attendee@example.com', 'notes': '', 'weeks': 3 })
+
+    def booked(self):
+        return [ e for e in self.book_calendar.events if not e['deleted'] ]
+
+    def test_series(self):
+        response = self.book()
+        self.assertContains(response, 'Booking confirmed')
+        self.assertEqual(sorted(e['start'] for e in self.booked()),
+                         [ format_time(start) for start in self.starts ])
+
+        # One email to each party, with every date in the invitation.
+        messages = [ bytes(m.message) for m in OutboxMessage.objects.all() ]
+        self.assertEqual(len(messages), 2)
+        invites = [
+            part.get_payload(decode=True)
+            for m in messages for part in email.message_from_bytes(m).walk()
+            if part.get_content_type() == 'text/calendar'
+        ]
+        self.assertEqual([ i.count(b'BEGIN:VEVENT') for i in invites ], [ 3 ])
+
+    def test_series_rolled_back(self):
+        upsert = self.cronofy.upsert_event
+        failed = format_time(self.starts[1])
+
+        def upsert_event(calendar_id, event):
+            if format_time(event['start']) == failed:
+                raise RuntimeError("Cronofy is down")
+            return upsert(calendar_id, event)
+
+        with mock.patch.object(self.cronofy, 'upsert_event', side_effect=upsert_event), \
+                mock.patch.object(self.cronofy, 'delete_event',
+                                  wraps=self.cronofy.delete_event) as delete_event:
+            response = self.book()
+
+        self.assertContains(response, 'Something went wrong')
+        self.assertEqual(delete_event.call_count, 2)
+        self.assertEqual(self.booked(), [])
+        self.assertFalse(OutboxMessage.objects.exists())
+
+class OutboxTests(TestCase):
+    """
+    Sends queued messages through the test email backend.
+    """
+
+    def setUp(self):
+        patcher = mock.patch.object(outbox, 'EMAIL_SEND_IN_BACKGROUND', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        outbox.enqueue(EmailMessage('Booking confirmed', 'See you then.',
+                                    'pyappointment@example.com', ['attendee@example.com']))
+
+    def test_send(self):
+        self.assertEqual(outbox.send_pending(), 1)
+        self.assertFalse(OutboxMessage.objects.exists())
+
+        self.assertEqual(len(mail.outbox), 1)
+        sent = mail.outbox[0]
+        self.assertEqual(sent.recipients(), ['attendee@example.com'])
+        self.assertEqual(sent.subject, 'Booking confirmed')
+        self.assertEqual(sent.message().get_payload(), 'See you then.')
+
+    def test_give_up(self):
+        OutboxMessage.objects.update(attempts=outbox.EMAIL_MAX_ATTEMPTS - 1)
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        side_effect=OSError("Connection refused")), \
+                self.assertLogs(outbox.logger, 'ERROR'):
+            self.assertEqual(outbox.send_pending(), 0)
+
+        msg = OutboxMessage.objects.get()
+        self.assertEqual(msg.attempts, outbox.EMAIL_MAX_ATTEMPTS)
+        self.assertEqual(msg.last_error, "Connection refused")
+        self.assertEqual(outbox.claim_batch(1), [])
+
+class BusyIndexTests(TestCase):
+    """
+    Checks slots against busy intervals as epoch seconds.
+    """
+
+    def test_zero_length_event(self):
+        busy = calendar_link.BusyIndex([ (0, 3600, 'Meeting'), (5400, 5400, 'Reminder') ])
+
+        # The reminder only conflicts with slots it falls strictly inside.
+        self.assertEqual(busy.conflict(3600, 7200), 'Reminder')
+        self.assertIsNone(busy.conflict(3600, 5400))
+        self.assertIsNone(busy.conflict(5400, 7200))
+        self.assertEqual(busy.conflict(1800, 7200), 'Meeting')
+        self.assertEqual(availability.interval_subtract([ (0, 7200) ], busy.between(0, 7200)),
+                         [ (3600, 5400), (5400, 7200) ])
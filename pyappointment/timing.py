@@ -0,0 +1,86 @@
+import collections
+import contextlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Number of recent samples kept per phase for the aggregated statistics.
+SAMPLES = 1000
+
+_local = threading.local()
+_stats = collections.defaultdict(lambda: collections.deque(maxlen=SAMPLES))
+_lock  = threading.Lock()
+
+@contextlib.contextmanager
+def timed(phase):
+    """
+    Times the enclosed block, adding it to the current request's timings (if
+    any) and to this worker's statistics under the name phase.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - start)
+
+def record(phase, duration):
+    phases = getattr(_local, 'phases', None)
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0) + duration
+
+    with _lock:
+        _stats[phase].append(duration)
+
+def percentile(samples, p):
+    """
+    Returns the p-th percentile of a sorted list of samples, by nearest rank.
+    """
+    return samples[max(0, min(len(samples) - 1, int(round(p / 100 * len(samples))) - 1))]
+
+def stats():
+    """
+    Returns a dict of per-phase statistics for this worker: the number of
+    recent samples and their 50th, 95th and 99th percentiles in milliseconds.
+    """
+    with _lock:
+        samples = { phase: sorted(s) for phase, s in _stats.items() }
+
+    return {
+        phase: {
+            'count': len(s),
+            'p50': round(percentile(s, 50) * 1000, 2),
+            'p95': round(percentile(s, 95) * 1000, 2),
+            'p99': round(percentile(s, 99) * 1000, 2),
+        }
+        for phase, s in samples.items() if s
+    }
+
+class TimingMiddleware():
+    """
+    Collects the timed phases of each request, and reports them in a
+    Server-Timing response header and a log line.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _local.phases = collections.OrderedDict()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            phases = _local.phases
+            _local.phases = None
+
+        phases['total'] = time.perf_counter() - start
+        record('total', phases['total'])
+
+        response['Server-Timing'] = ', '.join(
+            '%s;dur=%.1f' % (phase, duration * 1000) for phase, duration in phases.items())
+        logger.info('path=%s status=%d %s', request.path, response.status_code, ' '.join(
+            '%s=%.1fms' % (phase, duration * 1000) for phase, duration in phases.items()))
+
+        return response
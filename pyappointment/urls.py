@@ -5,12 +5,17 @@ import django
 
 from pyappointment import settings, views
 
-mtypes = '|'.join(settings.BOOKING_TYPES.keys())
+# Booking types are looked up by name in the views, rather than listed here.
+mtype = r'([\w-]+)'
+date  = r'([1-2][0-9]{3})-([0-1][0-9])-([0-3][0-9])'
 
 urlpatterns = [
     url(r'^$', views.index),
-    url(r'^(' + mtypes + r')/?$', views.view_booking_type),
-    url(r'^(' + mtypes + r')/?$', views.view_booking_type),
-    url(r'^(' + mtypes + r')/([1-2][0-9]{3})-([0-1][0-9])-([0-3][0-9])/?$', views.view_week),
-    url(r'^book/(' + mtypes + r')/([1-2][0-9]{3})-([0-1][0-9])-([0-3][0-9])/([0-2][0-9])-([0-5][0-9])?$', views.booking_form)
+    url(r'^stats/timing/?$', views.timing_stats),
+    url(r'^cronofy/notify/([\w-]+)/?$', views.cronofy_notification),
+    url(r'^' + mtype + r'/?$', views.view_booking_type),
+    url(r'^api/' + mtype + r'/availability/?$', views.api_availability),
+    url(r'^' + mtype + r'/' + date + r'/?$', views.view_week),
+    url(r'^' + mtype + r'/' + date + r'/next/?$', views.view_next_available),
+    url(r'^book/' + mtype + r'/' + date + r'/([0-2][0-9])-([0-5][0-9])?$', views.booking_form)
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
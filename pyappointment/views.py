@@ -1,28 +1,42 @@
-from django.shortcuts import render, render_to_response
-from django.http import HttpResponse, Http404
+from django.shortcuts import redirect, render, render_to_response
+from django.template.loader import render_to_string
+from django.http import HttpResponse, HttpResponseBadRequest, Http404, JsonResponse, \
+    StreamingHttpResponse
 from django.contrib import messages
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 
+import array
 import datetime as dt
-import dateutil.parser
+import functools
+import hashlib
+import json
+import math
+import time
 import uuid
 import pytz
 
-from pyappointment import settings, calendar_link
+from pyappointment import settings, calendar_link, grid, localtime, timing
 from pyappointment.email import send_attendee_email, send_organizer_email
-from pyappointment.availability import MEETING_AVAIL, Availability
+from pyappointment.availability import BOOKING_RULES, booking_bounds, free_intervals, minute_of_day, \
+    slot_starts
 from pyappointment.forms import BookingForm
+from pyappointment.cache import make_cache
+from pyappointment.grid import WeekGrid
 
 LOCALTZ = pytz.timezone(settings.TIME_ZONE)
 
-def convert_iso8601(iso_str, tz):
-    """
-    Converts a date in ISO 8601 format to a datetime object, given a timezone tz.
-    """
-    tmp = dateutil.parser.parse(iso_str)
-    if tmp.tzinfo is None:
-        # All-day event, so assume we're in the local timezone
-        tmp = LOCALTZ.localize(tmp)
-    return tmp.astimezone(tz)
+# Longest range of days that the availability API returns at once.
+API_MAX_DAYS = 92
+
+# How far ahead to look for a free slot, if there is no future limit.
+NEXT_AVAILABLE_DAYS = 366
+
+# Rendered week views, keyed by booking type, week and busy intervals.
+week_cache = make_cache('weeks', settings.CALENDAR_STALE_TTL, settings.CALENDAR_CACHE_SIZE)
 
 def replace_time(date, time):
     """
@@ -37,84 +51,119 @@ def get_monday(date):
     """
     return date - dt.timedelta(date.weekday())
 
-def perdelta(start, end, delta):
-    curr = start
-    while curr < end:
-        yield curr
-        curr += delta
+def booking_type_view(view):
+    """
+    Decorates a view taking a booking type from the URL, so that unknown
+    booking types give a 404. The URLs match any name, and the booking type
+    is looked up here instead.
+    """
+    @functools.wraps(view)
+    def wrapper(request, booking_type, *args):
+        if booking_type not in settings.BOOKING_TYPES:
+            raise Http404("Unknown booking type")
+        return view(request, booking_type, *args)
+    return wrapper
+
+def request_now(request):
+    """
+    Returns the time of a request in epoch seconds. It is only taken once, so
+    that everything worked out while answering the request agrees on it.
+    """
+    if not hasattr(request, 'now'):
+        request.now = time.time()
+    return request.now
+
+def slot_status(booking_type, start, finish, busy, now=None):
+    """
+    Returns the reason code for whether a slot from start to finish can be
+    booked, checked against the time now in epoch seconds (by default, the
+    current time).
+    """
+    if now is None:
+        now = time.time()
+    return slot_code(booking_type, start.date(),
+                     minute_of_day(start), minute_of_day(finish),
+                     calendar_link.to_timestamp(start), calendar_link.to_timestamp(finish),
+                     busy, now)
+
+def slot_code(booking_type, day, start_minute, finish_minute, start, finish, busy, now):
+    """
+    Does the work of slot_status for a slot given as epoch seconds start and
+    finish, which fall start_minute and finish_minute minutes into the local
+    day, so that no datetimes are needed.
+    """
+    booking_info = settings.BOOKING_TYPES[booking_type]
 
-def check_available(booking_info, start, finish, events):
     # First, check this time isn't in the past.
-    now = dt.datetime.now(LOCALTZ)
     if start < now:
-        return False, "date in the past"
+        return grid.PAST
 
     # Now check if we have sufficient lead time for this booking type.
-    lead_time = booking_info['lead_time']
-    if start < now + dt.timedelta(hours=lead_time):
-        return False, "not enough lead time: bookings must be at least {:d} {:s} in advance".format(
-            lead_time, 'hour' if lead_time == 1 else 'hours')
+    if start < now + booking_info['lead_time'] * 3600:
+        return grid.LEAD_TIME
 
     # Don't let anyone book later than an upper limit.
     upper_limit = booking_info['future_limit']
-    if upper_limit != 0 and start > now + dt.timedelta(days=upper_limit):
-        return False, "date too far in the future"
-
-    # If this booking type defines a custom availability, check against this.
-    if 'availability' in booking_info:
-        # Determine if we've defined a specific date for this booking
-        # type. Specific dates are defined in the form 'YYYY-MM-DD'. In this
-        # case, we ignore _any_ other general dates given in the availability
-        # list.
-        specific_dates = False
-        for key in booking_info['availability'].keys():
-            if '-' in key:
-                specific_dates = True
-                break
-
-        avail = False
-        if specific_dates:
-            for key, val in booking_info['availability'].items():
-                if '-' not in key:
-                    continue
-
-                # Parse this date and check it matches our key.
-                d_y, d_m, d_d = [ int(a) for a in key.split('-') ]
-                if dt.date(d_y, d_m, d_d) != start.date():
-                    continue
-
-                # Construct availability
-                avail = Availability.from_config(val).is_available(start.time(), finish.time())
-                if avail:
-                    break
+    if upper_limit != 0 and start > now + upper_limit * 86400:
+        return grid.TOO_FAR
+
+    # Check against the compiled availability rules for this booking type.
+    avail = BOOKING_RULES[booking_type].for_date(day)
+    if not avail.covers(start_minute, finish_minute):
+        return grid.NOT_AVAILABLE
+
+    # Finally, check against the busy intervals from the calendar.
+    if busy.conflict(start, finish) is not None:
+        return grid.CONFLICT
+
+    return grid.AVAILABLE
+
+def reason_text(booking_type, code, start, finish, busy):
+    """
+    Returns the text explaining a reason code from slot_status.
+    """
+    if code == grid.PAST:
+        return "date in the past"
+    if code == grid.LEAD_TIME:
+        lead_time = settings.BOOKING_TYPES[booking_type]['lead_time']
+        return "not enough lead time: bookings must be at least {:d} {:s} in advance".format(
+            lead_time, 'hour' if lead_time == 1 else 'hours')
+    if code == grid.TOO_FAR:
+        return "date too far in the future"
+    if code == grid.NOT_AVAILABLE:
+        return "non-available time"
+    if code == grid.CONFLICT:
+        if settings.SHOW_CONFLICTING_EVENTS:
+            return "conflicts with event: " + busy.conflict(
+                calendar_link.to_timestamp(start), calendar_link.to_timestamp(finish))
         else:
-            # Check against normal availability.
-            dow = start.strftime('%a').upper()
-            avail_val = booking_info['availability'].get(dow)
-            if avail_val is not None:
-                avail = Availability.from_config(avail_val).is_available(start.time(), finish.time())
-
-        if not avail:
-            return False, "non-available time"
-
-    elif not MEETING_AVAIL[start.weekday()].is_available(start.time(), finish.time()):
-        # Check hard-coded availability times.
-        return False, "non-available time"
-
-    # Finally, check against events.
-    for e in events:
-        e_start = convert_iso8601(e['start'], LOCALTZ)
-        e_end   = convert_iso8601(e['end'], LOCALTZ)
-
-        if start < e_end and finish > e_start:
-            if settings.SHOW_CONFLICTING_EVENTS:
-                return False, "conflicts with event: " + e['summary']
-            else:
-                return False, "conflicts with existing event"
+            return "conflicts with existing event"
+    return "available"
 
-    return True, "available"
+def check_available(booking_type, start, finish, busy, now=None):
+    code = slot_status(booking_type, start, finish, busy, now)
+    return code == grid.AVAILABLE, reason_text(booking_type, code, start, finish, busy)
+
+def calendar_error(request, booking_type=None, date=None):
+    """
+    Renders an error page for when the calendar can't be reached.
+    """
+    params = {
+        'error_title': 'Calendar unavailable',
+        'error_message': 'Availability can\'t be checked right now. Please try again in a few minutes.',
+    }
+    if booking_type is not None:
+        params['redirect']     = '/' + booking_type + '/' + date.strftime('%Y-%m-%d')
+        params['redirect_msg'] = '« Return to grid'
+    return render(request, 'error.html', params, status=503)
+
+def week_layout(booking_type, date):
+    """
+    Returns the indexes of the days shown in the week containing date, and the
+    earliest and latest times shown on them.
+    """
+    rules = BOOKING_RULES[booking_type]
 
-def generate_week_times(booking_info, date):
     # Calculate minimum and maximum times for the week's availability.
     min_time, max_time = dt.time.max, dt.time.min
 
@@ -124,131 +173,276 @@ def generate_week_times(booking_info, date):
     # Get monday before date.
     monday = get_monday(date)
 
-    for i, avail in enumerate(MEETING_AVAIL):
-        t_min, t_max = avail.day_range()
+    for i in range(7):
+        t_min, t_max = rules.display_range((monday + dt.timedelta(days=i)).date())
         if t_min is None:
             continue
 
-        # Check for specific availability regions to override minimum and
-        # maximum.
-        if 'availability' in booking_info:
-            date_i = monday + dt.timedelta(days=i)
-            for key, val in booking_info['availability'].items():
-                if '-' not in key:
-                    continue
-
-                d_y, d_m, d_d = [ int(a) for a in key.split('-') ]
-                if dt.date(d_y, d_m, d_d) != date_i.date():
-                    continue
+        min_time, max_time = min(min_time, t_min), max(max_time, t_max)
+        display_days.append(i)
 
-                t_min, t_max = Availability.from_config(val).day_range()
-                break
+    return display_days, min_time, max_time
 
-            if t_min is None:
-                continue
+def generate_week_times(booking_type, date, busy=None, now=None):
+    booking_info = settings.BOOKING_TYPES[booking_type]
+    rules        = BOOKING_RULES[booking_type]
 
-        min_time, max_time = min(min_time, t_min), max(max_time, t_max)
-        display_days.append(i)
+    display_days, min_time, max_time = week_layout(booking_type, date)
 
-    # Populate a list of times that we've available.
-    times    = []
     monday   = replace_time(get_monday(date), min_time)
     duration = dt.timedelta(minutes=booking_info['duration'])
     delta    = dt.timedelta(minutes=booking_info['slots'])
 
-    # Grab raw event data from calendar.
-    events = calendar_link.get_events(monday, 7)
-
-    # Track availability:
-    #
-    #   - one_availability is True if at least one slot in the week is free;
-    #   - prev_gap is True if the previous timeslot was a gap (i.e. no time was
-    #     available across all of the days);
-    #   - avail_days[i] is True if at least one appointment slot is available
-    #     for display_days[i].
-    #
-    # These are used to condense the week view to only a sensible range of
-    # times.
-    one_available = False
-    prev_gap      = False
-    avail_days    = [ False ] * len(display_days)
-
-    for d in perdelta(monday, replace_time(monday, max_time), delta):
-        tmp = []
-        no_avail = True
-        for n, i in enumerate(display_days):
-            date = d + dt.timedelta(days=i)
-
-            # First, check availability against specified limits.
-            available, reason = check_available(booking_info, date, date + duration, events)
-            if available:
-                no_avail      = False
-                one_available = True
-                avail_days[n] = True
-
-            tmp.append({
-                'date': date,
-                'available': available,
-                'reason': reason
-            })
+    # Grab busy intervals from calendar.
+    if busy is None:
+        busy = calendar_link.get_busy(monday, 7)
+    if now is None:
+        now = time.time()
+    started = time.perf_counter()
+
+    # Slot times are worked out in epoch seconds from the local seconds since
+    # midnight, using the UTC offsets of each day.
+    first_day = monday.date()
+    min_secs  = minute_of_day(min_time) * 60
+    step      = booking_info['slots'] * 60
+    length    = booking_info['duration'] * 60
+
+    # Find the start times of free slots on each displayed day, from the free
+    # intervals left once bookings bounds and busy times are taken into
+    # account.
+    lower, upper = booking_bounds(booking_info, now)
+    free_slots   = []
+    for i in display_days:
+        day    = first_day + dt.timedelta(days=i)
+        anchor = localtime.to_epoch(LOCALTZ, day, min_secs)
+        free   = free_intervals(rules, day, LOCALTZ, lower, upper, busy)
+        free_slots.append(set(slot_starts(free, anchor, step, length)))
+
+    # Record the state of every slot. Each day's timestamps are worked out by
+    # addition unless it has a daylight saving change, and only the slots
+    # that are rendered become datetimes.
+    start_of_week = monday.replace(tzinfo=None)
+    span          = replace_time(start_of_week, max_time) - start_of_week
+    nrows         = max(0, -(-span // delta))
+
+    def describe(code, date):
+        return reason_text(booking_type, code, date, date + duration, busy)
+
+    week   = WeekGrid(monday, start_of_week, delta, display_days, nrows, LOCALTZ,
+                      describe if settings.SHOW_REASONS else None)
+    ncols  = len(display_days)
+    stamps = array.array('q', bytes(8 * nrows * ncols))
+    for n, i in enumerate(display_days):
+        day   = first_day + dt.timedelta(days=i)
+        start = localtime.day_start(LOCALTZ, day)
+
+        for row in range(nrows):
+            secs = min_secs + row * step
+            if start is not None:
+                stamp = start + secs
+            else:
+                stamp = localtime.to_epoch(LOCALTZ, day, secs)
+            stamps[row * ncols + n] = stamp
+
+            if stamp in free_slots[n]:
+                week.codes[row * ncols + n] = grid.AVAILABLE
+            elif settings.SHOW_REASONS:
+                # Finish times are wall-clock times, as for slot_status.
+                week.codes[row * ncols + n] = slot_code(
+                    booking_type, day, secs // 60, (secs + length) // 60 % 1440,
+                    stamp, stamp + length, busy, now)
+
+    # Condense the week view to only a sensible range of times, removing any
+    # days where we're not available at all, if this is configured for this
+    # booking type.
+    week.layout(collapse=booking_info.get('collapse_days', False))
+    week.expires = grid_expiry(booking_info, stamps, now)
+
+    timing.record('availability', time.perf_counter() - started)
+    return week
+
+def grid_expiry(booking_info, stamps, now):
+    """
+    Returns the epoch second after which the passage of time may change the
+    availability of a slot starting at one of stamps: when the slot starts,
+    when it falls within the lead time, or when it comes within the future
+    limit. Returns None if there is no such time.
+    """
+    offsets = [ 0, booking_info['lead_time'] * 3600 ]
+    if booking_info['future_limit'] != 0:
+        offsets.append(booking_info['future_limit'] * 86400)
 
-        if not no_avail:
-            times.append(tmp)
-            prev_gap = False
-        else:
-            if not prev_gap:
-                times.append('gap')
-                prev_gap = True
-
-    # Remove any days where we're not fully available, if this is configured for
-    # this booking type.
-    if 'collapse_days' in booking_info and booking_info['collapse_days']:
-        times = [
-            [ d for i, d in enumerate(t) if avail_days[i] ]
-            if type(t) == list else t for t in times
+    return min((t - o for t in stamps for o in offsets if t - o > now), default=None)
+
+def day_slots(booking_type, day, lower, upper, busy, layouts):
+    """
+    Returns the sorted epoch seconds at which free slots start on day, as the
+    week view would show them: only on the days it displays, and lined up
+    with its rows, which run from the earliest time shown that week to the
+    latest. layouts caches the week_layout for each Monday.
+    """
+    booking_info = settings.BOOKING_TYPES[booking_type]
+
+    monday = get_monday(day)
+    if monday not in layouts:
+        layouts[monday] = week_layout(
+            booking_type, dt.datetime.combine(monday, dt.time()))
+    display_days, min_time, max_time = layouts[monday]
+    if (day - monday).days not in display_days:
+        return []
+
+    # Slots in rows past the last one aren't shown.
+    step     = booking_info['slots'] * 60
+    min_secs = minute_of_day(min_time) * 60
+    nrows    = max(0, -(-(minute_of_day(max_time) * 60 - min_secs) // step))
+    anchor   = localtime.to_epoch(LOCALTZ, day, min_secs)
+    limit    = localtime.to_epoch(LOCALTZ, day, min_secs + nrows * step)
+
+    # Overlapping availability windows can give the same slot more than once.
+    free = free_intervals(BOOKING_RULES[booking_type], day, LOCALTZ, lower, upper, busy)
+    return sorted(set(
+        slot for slot in slot_starts(free, anchor, step, booking_info['duration'] * 60)
+        if slot < limit))
+
+def next_available(booking_type, after, now=None):
+    """
+    Returns the start of the first bookable slot at or after the datetime
+    after, or None if there is none before the future limit (or within
+    NEXT_AVAILABLE_DAYS, if there is no limit), as of the time now in epoch
+    seconds (by default, the current time).
+
+    The calendar is read a week at a time at first, then in windows that
+    double in size, and days with no availability are skipped without
+    reading it at all.
+    """
+    booking_info = settings.BOOKING_TYPES[booking_type]
+    rules        = BOOKING_RULES[booking_type]
+
+    if now is None:
+        now = time.time()
+    lower, upper = booking_bounds(booking_info, now)
+    lower        = max(lower, math.ceil(after.timestamp()))
+    if upper is None:
+        upper = int(now) + NEXT_AVAILABLE_DAYS * 86400
+
+    layouts = {}
+    monday  = get_monday(after.astimezone(LOCALTZ).date())
+    weeks   = 1
+    while localtime.to_epoch(LOCALTZ, monday, 0) < upper:
+        days = [
+            monday + dt.timedelta(days=i) for i in range(7 * weeks)
+            if rules.for_date(monday + dt.timedelta(days=i)).time_ranges and
+               rules.display_range(monday + dt.timedelta(days=i))[0] is not None
         ]
 
-    # Trim from start of array
-    if len(times) > 0:
-        if times[0] == 'gap':
-            times.pop(0)
+        if days:
+            # The first week is read just as the week view reads it, so that
+            # the cached data is shared with it.
+            if weeks == 1:
+                busy = calendar_link.get_busy(
+                    LOCALTZ.localize(dt.datetime.combine(monday, dt.time())), 7)
+            else:
+                busy = calendar_link.get_busy(
+                    LOCALTZ.localize(dt.datetime.combine(days[0], dt.time())),
+                    (days[-1] - days[0]).days + 1, summaries=False)
 
-    # Trim from end of array
-    if len(times) > 0:
-        if times[-1] == 'gap':
-            times.pop()
+            for day in days:
+                slots = day_slots(booking_type, day, lower, upper, busy, layouts)
+                if slots:
+                    return dt.datetime.fromtimestamp(slots[0], LOCALTZ)
 
-    return { 'times': times, 'one_available': one_available, 'monday': monday }
+        monday += dt.timedelta(days=7 * weeks)
+        weeks  *= 2
 
-def view_week(request, booking_type, year, month, day):
-    try:
-        date = LOCALTZ.localize(dt.datetime(int(year), int(month), int(day), hour=9))
-    except ValueError:
-        raise Http404("Date does not exist")
+    return None
+
+def week_page(booking_type, date, now=None):
+    """
+    Returns the rendered week view for the week containing date, as a dict
+    holding its content, ETag, modification and expiry times, and the dates
+    linked to as the previous and next weeks, as of the time now in epoch
+    seconds (by default, the current time).
 
-    now       = dt.datetime.now(LOCALTZ)
+    The page only changes when the busy intervals do or when it expires, so
+    it is rendered once and then served from the cache.
+    """
+    if now is None:
+        now = time.time()
     monday    = get_monday(date)
     prev_date = monday - dt.timedelta(days=7)
     next_date = monday + dt.timedelta(days=7)
 
-    if prev_date < now - dt.timedelta(days=7):
+    if prev_date.timestamp() < now - 7 * 86400:
         prev_date = None
 
     booking_info = settings.BOOKING_TYPES[booking_type]
     future_limit = booking_info['future_limit']
-    if future_limit != 0 and next_date > now + dt.timedelta(days=future_limit):
+    if future_limit != 0 and next_date.timestamp() > now + future_limit * 86400:
         next_date = None
 
-    return render(request, 'week_view.html', {
-        'times': generate_week_times(booking_info, date),
-        'booking_type': booking_type,
-        'booking_info': booking_info,
-        'organizer': settings.ORGANIZER_NAME,
-        'prev_date': prev_date,
-        'next_date': next_date,
-        'show_reasons': settings.SHOW_REASONS
-    })
+    min_time = week_layout(booking_type, date)[1]
+    busy     = calendar_link.get_busy(replace_time(monday, min_time), 7)
+
+    key  = (booking_type, monday.date(), busy.fingerprint())
+    page = week_cache.get(key)
+    if page is None or (page['expires'] is not None and page['expires'] <= now):
+        times = generate_week_times(booking_type, date, busy, now)
+
+        # The previous and next week buttons also come and go with time.
+        expires = [ times.expires, calendar_link.to_timestamp(monday) ]
+        if future_limit != 0:
+            expires.append(calendar_link.to_timestamp(monday + dt.timedelta(days=7))
+                           - future_limit * 86400)
+        expires = min((t for t in expires if t is not None and t > now),
+                      default=None)
+
+        with timing.timed('render'):
+            content = render_to_string('week_view.html', {
+                'times': times,
+                'booking_type': booking_type,
+                'booking_info': booking_info,
+                'organizer': settings.ORGANIZER_NAME,
+                'prev_date': prev_date,
+                'next_date': next_date,
+                'show_reasons': settings.SHOW_REASONS
+            })
+
+        page = {
+            'content': content,
+            'expires': expires,
+            'modified': int(now),
+            'etag': quote_etag(hashlib.sha1(repr(key + (expires,)).encode('utf-8')).hexdigest()),
+            'neighbours': [ d for d in (prev_date, next_date) if d is not None ]
+        }
+        week_cache.set(key, page)
+
+    return page
+
+@booking_type_view
+def view_week(request, booking_type, year, month, day):
+    try:
+        date = LOCALTZ.localize(dt.datetime(int(year), int(month), int(day), hour=9))
+    except ValueError:
+        raise Http404("Date does not exist")
 
+    try:
+        page = week_page(booking_type, date, request_now(request))
+    except calendar_link.CalendarUnavailable:
+        return calendar_error(request)
+
+    # Fetch the neighbouring weeks in the background, ready for navigation.
+    if settings.CALENDAR_PREFETCH:
+        calendar_link.prefetch(page['neighbours'], 7)
+
+    # Clients that already have the page get 304 Not Modified.
+    response = HttpResponse(page['content'])
+    response['ETag'] = page['etag']
+    response['Last-Modified'] = http_date(page['modified'])
+    patch_cache_control(response, no_cache=True)
+    return get_conditional_response(
+        request, etag=page['etag'], last_modified=page['modified'], response=response)
+
+@booking_type_view
 def booking_form(request, booking_type, year, month, day, hour, minute):
     try:
         date = LOCALTZ.localize(dt.datetime(
@@ -258,23 +452,41 @@ def booking_form(request, booking_type, year, month, day, hour, minute):
     except ValueError:
         raise Http404("Date does not exist")
 
-    # Validate availability.
-    handle = calendar_link.connect_calendar()
-    cal_ids = handle.list_calendars()
-    events = calendar_link.get_events(
-        date, 1, handle=handle, cal_ids=calendar_link.filter_ids(cal_ids))
+    booking_info = settings.BOOKING_TYPES[booking_type]
+    duration     = dt.timedelta(minutes=booking_info['duration'])
+    max_weeks    = booking_info.get('max_weeks', 1)
 
-    book_cal_id = [
-        c['calendar_id'] for c in cal_ids if
-        c['calendar_name'].lower() == settings.CAL_CREATE_BOOKING.lower()
-    ][0]
+    if request.method == 'POST':
+        form  = BookingForm(request.POST, max_weeks=max_weeks)
+        weeks = (form.cleaned_data.get('weeks') or 1) if form.is_valid() else 1
+    else:
+        form  = BookingForm(max_weeks=max_weeks)
+        weeks = 1
 
-    booking_info = settings.BOOKING_TYPES[booking_type]
-    duration     = booking_info['duration']
-    start        = date
-    finish       = date + dt.timedelta(minutes=duration)
+    # A series is booked at the same local time each week.
+    local  = date.replace(tzinfo=None)
+    starts = [ date ] + [
+        LOCALTZ.localize(local + dt.timedelta(weeks=n)) for n in range(1, weeks) ]
 
-    if not check_available(booking_info, start, finish, events)[0]:
+    # Validate availability, reading the calendar once for the whole series.
+    # Bookings are always checked against fresh data.
+    handle = calendar_link.connect_calendar()
+    try:
+        cal_ids, book_cal_id = calendar_link.calendar_ids(handle)
+        busy = calendar_link.get_busy(
+            date, 7 * (weeks - 1) + 1, handle=handle, cal_ids=cal_ids,
+            fresh=request.method == 'POST', summaries=False)
+    except calendar_link.CalendarUnavailable:
+        return calendar_error(request, booking_type, date)
+
+    now = request_now(request)
+    with timing.timed('availability'):
+        unavailable = [
+            start for start in starts
+            if slot_status(booking_type, start, start + duration, busy, now) != grid.AVAILABLE
+        ]
+
+    if date in unavailable:
         return render(request, 'error.html', {
             'error_title': 'Booking error',
             'error_message': 'This slot is not available for bookings.',
@@ -283,22 +495,27 @@ def booking_form(request, booking_type, year, month, day, hour, minute):
         })
 
     if request.method == 'POST':
-        form = BookingForm(request.POST)
         if not form.is_valid():
             messages.error(request, "Error in your form. Please check below.")
+        elif unavailable:
+            messages.error(request, "This time is not available on %s. Please book fewer weeks." %
+                           ', '.join(start.strftime('%d %B') for start in unavailable))
         else:
-            try:
-                event = {
+            events = [
+                {
                     'event_id': 'book-%s' % uuid.uuid4(),
                     'summary': booking_info['description'] + ': ' + form.cleaned_data['name'],
                     'description': form.cleaned_data['notes'],
                     'start': start.astimezone(pytz.utc),
-                    'end': finish.astimezone(pytz.utc),
+                    'end': (start + duration).astimezone(pytz.utc),
                     'tzid': str(LOCALTZ)
                 }
+                for start in starts
+            ]
 
-                handle.upsert_event(calendar_id=book_cal_id, event=event)
-            except:
+            try:
+                calendar_link.upsert_events(book_cal_id, events, handle)
+            except calendar_link.CalendarUnavailable:
                 return render(request, 'error.html', {
                     'error_title': 'Booking error',
                     'error_message': 'Something went wrong! Try again.',
@@ -306,42 +523,157 @@ def booking_form(request, booking_type, year, month, day, hour, minute):
                     'redirect_msg': '« Return to grid'
                 })
 
-            # Send reminder email.
-            send_attendee_email(start, finish, form.cleaned_data['name'], booking_type,
-                                form.cleaned_data['notes'], event['event_id'],
-                                form.cleaned_data['email'])
-            send_organizer_email(start, finish, form.cleaned_data['name'], booking_type,
-                                 form.cleaned_data['notes'], event['event_id'])
-
-            return render(request, 'book_success.html', {
-                'date': start,
-                'booking_type': booking_type,
-                'booking_info': booking_info,
-                'redirect': '/' + booking_type + '/' + date.strftime('%Y-%m-%d'),
-                'redirect_msg': '« Return to grid'
-            })
+            # Record the bookings so the slots can't be offered again.
+            for event in events:
+                calendar_link.record_booking(book_cal_id, event)
+
+            # Queue one confirmation for the whole series to each party, which
+            # are sent by the outbox.
+            occurrences = [
+                (start, start + duration, event['event_id'])
+                for start, event in zip(starts, events)
+            ]
+            with timing.timed('email'):
+                send_attendee_email(occurrences, form.cleaned_data['name'], booking_type,
+                                    form.cleaned_data['notes'], form.cleaned_data['email'])
+                send_organizer_email(occurrences, form.cleaned_data['name'], booking_type,
+                                     form.cleaned_data['notes'])
+
+            with timing.timed('render'):
+                return render(request, 'book_success.html', {
+                    'date': date,
+                    'dates': starts,
+                    'booking_type': booking_type,
+                    'booking_info': booking_info,
+                    'redirect': '/' + booking_type + '/' + date.strftime('%Y-%m-%d'),
+                    'redirect_msg': '« Return to grid'
+                })
 
-    else:
-        form = BookingForm()
-
-    return render(request, 'book.html', {
-        'form': form,
-        'date': date,
-        'booking_type': booking_type,
-        'booking_info': booking_info,
-        'duration': 30
-    })
+    with timing.timed('render'):
+        return render(request, 'book.html', {
+            'form': form,
+            'date': date,
+            'booking_type': booking_type,
+            'booking_info': booking_info,
+            'duration': 30
+        })
 
+@booking_type_view
 def view_booking_type(request, booking_type):
-    now = dt.datetime.now(LOCALTZ)
-    return view_week(request, booking_type, now.year, now.month, now.day)
+    # Open on the week with the next free slot, rather than an empty one.
+    now  = request_now(request)
+    date = dt.datetime.fromtimestamp(now, LOCALTZ)
+    try:
+        date = next_available(booking_type, date, now) or date
+    except calendar_link.CalendarUnavailable:
+        pass
+    return view_week(request, booking_type, date.year, date.month, date.day)
 
-def index(request):
-    now = dt.datetime.now(LOCALTZ)
+@booking_type_view
+def view_next_available(request, booking_type, year, month, day):
+    """
+    Redirects to the week containing the first free slot on or after the
+    given date, or to that date's week if there is none.
+    """
+    try:
+        date = LOCALTZ.localize(dt.datetime(int(year), int(month), int(day)))
+    except ValueError:
+        raise Http404("Date does not exist")
+
+    try:
+        date = next_available(booking_type, date, request_now(request)) or date
+    except calendar_link.CalendarUnavailable:
+        return calendar_error(request)
+    return redirect('/' + booking_type + '/' + date.strftime('%Y-%m-%d'))
 
+@booking_type_view
+def api_availability(request, booking_type):
+    """
+    Returns the free slots of a booking type between the from and to dates
+    (inclusive, as YYYY-MM-DD) as JSON, streamed one day at a time. The
+    calendar is read once for the whole range.
+    """
+    try:
+        first = dt.datetime.strptime(request.GET['from'], '%Y-%m-%d').date()
+        last  = dt.datetime.strptime(request.GET.get('to', request.GET['from']), '%Y-%m-%d').date()
+    except (KeyError, ValueError):
+        return JsonResponse({ 'error': 'from and to must be dates as YYYY-MM-DD' }, status=400)
+
+    days = (last - first).days + 1
+    if not 0 < days <= API_MAX_DAYS:
+        return JsonResponse({
+            'error': 'to must be on or after from, and at most %d days later' % (API_MAX_DAYS - 1)
+        }, status=400)
+
+    booking_info = settings.BOOKING_TYPES[booking_type]
+
+    try:
+        busy = calendar_link.get_busy(
+            LOCALTZ.localize(dt.datetime.combine(first, dt.time())), days, summaries=False)
+    except calendar_link.CalendarUnavailable:
+        return JsonResponse({ 'error': 'Calendar unavailable' }, status=503)
+
+    lower, upper = booking_bounds(booking_info, request_now(request))
+
+    def generate():
+        yield '{"booking_type":%s,"duration":%d,"timezone":%s,"days":[' % (
+            json.dumps(booking_type), booking_info['duration'],
+            json.dumps(settings.TIME_ZONE))
+
+        layouts = {}
+        for n in range(days):
+            day   = first + dt.timedelta(days=n)
+            slots = [
+                dt.datetime.fromtimestamp(t, LOCALTZ).strftime('%H:%M')
+                for t in day_slots(booking_type, day, lower, upper, busy, layouts)
+            ]
+
+            yield ('' if n == 0 else ',') + json.dumps(
+                { 'date': day.isoformat(), 'slots': slots }, separators=(',', ':'))
+        yield ']}'
+
+    return StreamingHttpResponse(generate(), content_type='application/json')
+
+def index(request):
     return render(request, 'index.html', {
         'organizer': settings.ORGANIZER_NAME,
         'booking_types': {
             k: v for k, v in settings.BOOKING_TYPES.items() if not v['hidden']
         }
     })
+
+def timing_stats(request):
+    """
+    Returns per-phase timing statistics for this worker, if enabled.
+    """
+    if not settings.TIMING_STATS:
+        raise Http404("Timing statistics are disabled")
+    return JsonResponse(timing.stats())
+
+@csrf_exempt
+@require_POST
+def cronofy_notification(request, token):
+    """
+    Receives push notifications from Cronofy, dropping cached calendar data
+    for the times affected by each change.
+    """
+    if not settings.CRONOFY_NOTIFICATION_TOKEN or \
+            not constant_time_compare(token, settings.CRONOFY_NOTIFICATION_TOKEN):
+        raise Http404("Unknown notification channel")
+
+    try:
+        notification = json.loads(request.body.decode('utf-8'))['notification']
+        if notification['type'] == 'change':
+            import dateutil.parser
+            changes_since = dateutil.parser.parse(notification['changes_since'])
+    except (ValueError, KeyError, TypeError):
+        return HttpResponseBadRequest("Malformed notification")
+
+    if notification['type'] == 'change':
+        try:
+            calendar_link.apply_changes(changes_since)
+        except calendar_link.CalendarUnavailable:
+            # Without knowing what changed, nothing cached can be trusted.
+            calendar_link.busy_cache.clear()
+
+    return HttpResponse(status=204)